@@ -5,11 +5,21 @@
 # - Email opzionali via SendGrid (SENDGRID_API_KEY, NOTIFY_EMAIL)
 # - Date tolleranti: "YYYY-MM-DD" o "DD/MM/YYYY"
 
-from datetime import datetime, timedelta
-from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+from collections import OrderedDict, defaultdict
+from itertools import accumulate
+import bisect
+import heapq
+import math
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+import numpy as np
 import os
+import secrets
+import threading
+import time
 
 # ---------------------------
 #  Opzioni / Integrazioni
@@ -18,11 +28,31 @@ DATABASE_URL    = os.getenv("DATABASE_URL")        # es. postgres://...
 SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY")   # opzionale
 NOTIFY_EMAIL     = os.getenv("NOTIFY_EMAIL")       # opzionale (mittente/destinatario)
 ADMIN_TOKEN      = os.getenv("ADMIN_TOKEN", "")    # opzionale per endpoint admin
+QUOTE_BATCH_MAX  = int(os.getenv("QUOTE_BATCH_MAX", "500"))  # max preventivi per /quote/batch
+AVAILABILITY_RANGE_MAX = int(os.getenv("AVAILABILITY_RANGE_MAX", "366"))  # max giorni per /availability/range
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "100"))  # max soggiorni restituiti da /search
+QUOTE_HORIZON_DAYS      = int(os.getenv("QUOTE_HORIZON_DAYS", "400"))     # check-in precalcolati (0 = off)
+QUOTE_TENSOR_MAX_NIGHTS = int(os.getenv("QUOTE_TENSOR_MAX_NIGHTS", "30")) # notti max precalcolate
+QUOTE_CACHE_SIZE        = int(os.getenv("QUOTE_CACHE_SIZE", "10000"))     # voci cache preventivi (0 = off)
+PRICING_MODE            = os.getenv("PRICING_MODE", "float").lower()      # "float" o "cents" (interi)
+INVENTORY_CACHE_TTL     = float(os.getenv("INVENTORY_CACHE_TTL", "2"))    # secondi cache letture inventario (DB o SHM)
+INVENTORY_SHM_NAME      = os.getenv("INVENTORY_SHM_NAME", "")             # inventario in shared memory (senza DB)
+INVENTORY_SHM_DAYS      = int(os.getenv("INVENTORY_SHM_DAYS", "4096"))    # giorni coperti dall'array condiviso
+INVENTORY_TREE_MAX_DAYS = int(os.getenv("INVENTORY_TREE_MAX_DAYS", "8192"))  # giorni max del segment tree in memoria
+BOOKING_HORIZON_DAYS    = int(os.getenv("BOOKING_HORIZON_DAYS", "730"))   # check-out prenotabile al più tra N giorni
+HOLD_TTL_MINUTES        = float(os.getenv("HOLD_TTL_MINUTES", "15"))      # durata (e massimo) di un hold
+HOLDS_MAX               = int(os.getenv("HOLDS_MAX", "10000"))            # hold in scadenza tenuti in memoria
+HOLD_REAP_INTERVAL      = float(os.getenv("HOLD_REAP_INTERVAL", "1"))     # secondi: scadenze ravvicinate escono insieme
+HOLD_SWEEP_INTERVAL     = float(os.getenv("HOLD_SWEEP_INTERVAL", "60"))   # secondi: con DB, giro anche senza hold locali
+WAITLIST_MAX            = int(os.getenv("WAITLIST_MAX", "50000"))        # richieste in attesa tenute in memoria (senza DB)
+ROOM_EXACT_MAX          = int(os.getenv("ROOM_EXACT_MAX", "12"))         # prenotazioni max per il piano camere esatto
+INVENTORY_SNAPSHOT      = os.getenv("INVENTORY_SNAPSHOT", f"{INVENTORY_SHM_NAME}.snapshot.npy" if INVENTORY_SHM_NAME else "")
 
 # DB opzionale (SQLAlchemy) — attivo solo se DATABASE_URL presente
 engine = None
 if DATABASE_URL:
     from sqlalchemy import create_engine, text
+    from sqlalchemy.exc import DBAPIError
     engine = create_engine(DATABASE_URL, pool_pre_ping=True)
 
 # Email opzionale (SendGrid) — attivo solo se API key + email presenti
@@ -70,24 +100,417 @@ def send_booking_email(booking_dict: dict):
         # non blocchiamo la prenotazione per un problema email
         app.logger.warning(f"SendGrid error: {e}")
 
+def send_waitlist_email(entry: dict):
+    """Offerta al cliente in lista d'attesa: hold da confermare con /book. Best-effort come send_booking_email."""
+    if not (SENDGRID_API_KEY and NOTIFY_EMAIL and entry.get("customer_email")):
+        return
+
+    lines = [
+        f"Si è liberato il soggiorno che aspettavi ({entry['waitlist_id']}):",
+        f"Camera: {entry['room_type']} | Check-in: {entry['checkin']} | Check-out: {entry['checkout']}",
+        f"Ospiti: {entry['guests']} | Totale: € {entry['total_price']}",
+        f"Bloccato per te fino alle {entry['expires_at']:%H:%M} UTC: conferma con hold_id {entry['hold_id']}",
+    ]
+    payload = {
+        "personalizations": [{"to": [{"email": entry["customer_email"]}],
+                              "subject": f"Disponibilità per {entry['checkin']} - {entry['checkout']}"}],
+        "from": {"email": NOTIFY_EMAIL},
+        "content": [{"type": "text/plain", "value": "\n".join(lines)}]
+    }
+    try:
+        r = requests.post(
+            "https://api.sendgrid.com/v3/mail/send",
+            headers={"Authorization": f"Bearer {SENDGRID_API_KEY}",
+                     "Content-Type": "application/json"},
+            json=payload, timeout=10
+        )
+        r.raise_for_status()
+    except Exception as e:
+        app.logger.warning(f"SendGrid error: {e}")
+
 app = Flask(__name__)
 CORS(app)
+app.logger.setLevel(os.getenv("LOG_LEVEL", "INFO"))
+
+# ---------------------------
+#  Inventario: strutture per giorno
+# ---------------------------
+class InventoryRangeError(ValueError):
+    """Scrittura su giorni fuori dal dominio che la struttura può coprire: 400 per il client, non 500."""
+
+class _DayCountsDict:
+    """Interfaccia dict del vecchio BOOKINGS ('YYYY-MM-DD' -> count) sopra counts/assign/_values."""
+
+    def __getitem__(self, key):
+        o = parse_date(key).toordinal()
+        return self.counts(o, o + 1)[0]
+
+    def get(self, key, default=0):
+        return self[key] or default
+
+    def __setitem__(self, key, value):
+        self.assign(parse_date(key).toordinal(), [value])
+
+    def items(self):
+        with self.lock:
+            return [(date.fromordinal(o).isoformat(), v) for o, v in sorted(self._values().items())]
+
+    def keys(self):
+        return [k for k, _ in self.items()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.items())
+
+    def __contains__(self, key):
+        return bool(self[key])
+
+class InventoryTree(_DayCountsDict):
+    """
+    Occupazione per giorno (ordinale di data) su un segment tree max/add con
+    propagazione lazy: massimo e incremento su un intervallo [a, b) in O(log n).
+    Espone anche l'interfaccia dict del vecchio BOOKINGS ('YYYY-MM-DD' -> count).
+    Il dominio cresce (alla potenza di 2 che copre il nuovo intervallo, al più
+    INVENTORY_TREE_MAX_DAYS) quando una scrittura cade fuori; le letture fuori
+    dominio valgono 0. Le operazioni composte (controlla e
+    poi incrementa) vanno fatte tenendo self.lock.
+    """
+
+    def __init__(self, days=1024, lock=None):
+        self.lock = lock or threading.RLock()
+        self._build(datetime.utcnow().date().toordinal() - 31, days, {})
+
+    def _build(self, base, days, values):
+        size = 1
+        while size < days:
+            size *= 2
+        self.base, self.size, self.log = base, size, size.bit_length() - 1
+        self.d = [0] * (2 * size)   # massimo del sottoalbero (lazy propri inclusi)
+        self.lz = [0] * size        # incremento pendente per i figli
+        for o, v in values.items():
+            self.d[size + o - base] = v
+        for k in range(size - 1, 0, -1):
+            self.d[k] = max(self.d[2 * k], self.d[2 * k + 1])
+
+    def _apply(self, k, x):
+        self.d[k] += x
+        if k < self.size:
+            self.lz[k] += x
+
+    def _push(self, k):
+        x = self.lz[k]
+        if x:
+            self._apply(2 * k, x)
+            self._apply(2 * k + 1, x)
+            self.lz[k] = 0
+
+    def _push_path(self, l, r):
+        for i in range(self.log, 0, -1):
+            if ((l >> i) << i) != l:
+                self._push(l >> i)
+            if ((r >> i) << i) != r:
+                self._push((r - 1) >> i)
+
+    def _push_range(self, l, r):
+        for i in range(self.log, 0, -1):
+            for k in range((l + self.size) >> i, ((r - 1 + self.size) >> i) + 1):
+                self._push(k)
+
+    def _pull_range(self, l, r):
+        d = self.d
+        for i in range(1, self.log + 1):
+            for k in range((l + self.size) >> i, ((r - 1 + self.size) >> i) + 1):
+                d[k] = max(d[2 * k], d[2 * k + 1])
+
+    def _writable(self, a, b):
+        """Indici foglia di [a, b), allargando il dominio se serve."""
+        if a < self.base or b > self.base + self.size:
+            values = self._values()
+            lo, hi = min(a, self.base), max(b, self.base + self.size)
+            if hi - lo > INVENTORY_TREE_MAX_DAYS:
+                # il vecchio dominio non ci sta: basta coprire i giorni occupati e la scrittura
+                lo, hi = min(a, *values), max(b, *(o + 1 for o in values))
+            if hi - lo > INVENTORY_TREE_MAX_DAYS:
+                raise InventoryRangeError(f"Date fuori dall'orizzonte inventario ({date.fromordinal(max(lo, 1))}"
+                                          f" - {date.fromordinal(min(hi, date.max.toordinal()))})")
+            size = 1 << (hi - lo - 1).bit_length()
+            # il margine va dal lato della scrittura: le successive nella stessa direzione non ricostruiscono
+            self._build(hi - size if a < self.base else lo, size, values)
+        return a - self.base, b - self.base
+
+    def _values(self):
+        self._push_range(0, self.size)
+        return {self.base + i: v for i, v in enumerate(self.d[self.size:]) if v}
+
+    def domain(self):
+        return self.base, self.base + self.size
+
+    def range_max(self, a, b):
+        """Occupazione massima sui giorni [a, b) (ordinali)."""
+        with self.lock:
+            l, r = max(a - self.base, 0), min(b - self.base, self.size)
+            if l >= r:
+                return 0
+            res = 0 if (l, r) != (a - self.base, b - self.base) else None
+            l += self.size
+            r += self.size
+            self._push_path(l, r)
+            d = self.d
+            while l < r:
+                if l & 1:
+                    res = d[l] if res is None else max(res, d[l])
+                    l += 1
+                if r & 1:
+                    r -= 1
+                    res = d[r] if res is None else max(res, d[r])
+                l >>= 1
+                r >>= 1
+            return res
+
+    def range_add(self, a, b, x):
+        """Aggiunge x all'occupazione dei giorni [a, b) (ordinali)."""
+        if b <= a:
+            return
+        with self.lock:
+            l, r = self._writable(a, b)
+            l += self.size
+            r += self.size
+            self._push_path(l, r)
+            l2, r2 = l, r
+            while l < r:
+                if l & 1:
+                    self._apply(l, x)
+                    l += 1
+                if r & 1:
+                    r -= 1
+                    self._apply(r, x)
+                l >>= 1
+                r >>= 1
+            d = self.d
+            for i in range(1, self.log + 1):
+                if ((l2 >> i) << i) != l2:
+                    k = l2 >> i
+                    d[k] = max(d[2 * k], d[2 * k + 1])
+                if ((r2 >> i) << i) != r2:
+                    k = (r2 - 1) >> i
+                    d[k] = max(d[2 * k], d[2 * k + 1])
+
+    def counts(self, a, b):
+        """Occupazione di ogni giorno [a, b) (ordinali), come lista."""
+        if b <= a:
+            return []
+        with self.lock:
+            l, r = max(a - self.base, 0), min(b - self.base, self.size)
+            if l >= r:
+                return [0] * (b - a)
+            self._push_range(l, r)
+            inside = self.d[self.size + l:self.size + r]
+            return [0] * (l - (a - self.base)) + inside + [0] * ((b - self.base) - r)
+
+    def assign(self, a, values):
+        """Imposta l'occupazione dei giorni a, a+1, ... ai valori dati."""
+        if not values:
+            return
+        with self.lock:
+            l, r = self._writable(a, a + len(values))
+            self._push_range(l, r)
+            self.d[self.size + l:self.size + r] = values
+            self._pull_range(l, r)
+
+class _ProcessLock:
+    """
+    Lock rientrante valido tra thread (RLock) e tra processi (flock su un file).
+    flock vale per descrittore aperto: i worker nati da fork (gunicorn --preload)
+    erediterebbero quello del master e non si escluderebbero, quindi il figlio
+    riapre il file subito dopo il fork, quando ha ancora un solo thread.
+    """
+
+    def __init__(self, path):
+        import fcntl
+        import weakref
+        self._flock = fcntl.flock
+        self._ex, self._un = fcntl.LOCK_EX, fcntl.LOCK_UN
+        self._path = path
+        self._open()
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() and ref()._reopen())
+
+    def _open(self):
+        self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._rlock = threading.RLock()
+        self._depth = 0
+
+    def _reopen(self):
+        # il descrittore ereditato resta al padre (e il suo flock con lui)
+        os.close(self._fd)
+        self._open()
+
+    def __enter__(self):
+        self._rlock.acquire()
+        if self._depth == 0:
+            self._flock(self._fd, self._ex)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            self._flock(self._fd, self._un)
+        self._rlock.release()
+
+class SharedInventory(_DayCountsDict):
+    """
+    Occupazione per giorno in un array int32 in shared memory, indicizzato per
+    ordinale, condiviso da tutti i worker Gunicorn dello stesso host (senza
+    DATABASE_URL). Il segmento si chiama `name`: chi arriva primo lo crea (con
+    --preload è il master, prima del fork), gli altri si agganciano. Le scritture
+    passano da un lock tra processi; i range sono operazioni numpy sull'array.
+    Il dominio è fisso: `days` giorni a partire da un anno fa alla creazione.
+    All'uscita lo stato viene salvato in `snapshot` e ricaricato alla prossima
+    creazione del segmento (es. dopo un riavvio della macchina).
+    """
+
+    _HEADER = 16  # int64 base + int64 giorni
+
+    def __init__(self, name, days=4096, snapshot=None, lock=None):
+        from multiprocessing import resource_tracker, shared_memory
+        self.name, self.snapshot = name, snapshot
+        self.lock = lock or _ProcessLock(os.path.join(os.path.dirname(os.path.abspath(snapshot or name)),
+                                                      f".{name}.lock"))
+        with self.lock:
+            try:
+                shm = shared_memory.SharedMemory(name=name, create=True, size=self._HEADER + 4 * days)
+                created = True
+            except FileExistsError:
+                shm = shared_memory.SharedMemory(name=name)
+                created = False
+            # il segmento deve sopravvivere al singolo worker: niente unlink automatico
+            resource_tracker.unregister(shm._name, "shared_memory")
+            self._shm = shm
+            header = np.ndarray((2,), dtype=np.int64, buffer=shm.buf)
+            if created:
+                header[:] = (datetime.utcnow().date().toordinal() - 365, days)
+                self._load_snapshot(header)
+            self.base, self.days = int(header[0]), int(header[1])
+            self.arr = np.ndarray((self.days,), dtype=np.int32, buffer=shm.buf, offset=self._HEADER)
+        import atexit
+        atexit.register(self.save_snapshot)
+
+    def _load_snapshot(self, header):
+        if not (self.snapshot and os.path.exists(self.snapshot)):
+            return
+        saved = np.load(self.snapshot)
+        base, counts = int(saved[0]), saved[1:]
+        arr = np.ndarray((int(header[1]),), dtype=np.int32, buffer=self._shm.buf, offset=self._HEADER)
+        lo, hi = max(base, int(header[0])), min(base + len(counts), int(header[0]) + len(arr))
+        if lo < hi:
+            arr[lo - int(header[0]):hi - int(header[0])] = counts[lo - base:hi - base]
+
+    def save_snapshot(self):
+        """Salva base + occupazioni su file (scrittura atomica con rename)."""
+        if not self.snapshot:
+            return
+        with self.lock:
+            data = np.concatenate(([self.base], self.arr.astype(np.int64)))
+        tmp = f"{self.snapshot}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, data)
+        os.replace(tmp, self.snapshot)
+
+    def _clip(self, a, b):
+        return max(a - self.base, 0), min(b - self.base, self.days)
+
+    def _writable(self, a, b):
+        if a < self.base or b > self.base + self.days:
+            raise InventoryRangeError(f"Date fuori dall'orizzonte inventario "
+                                      f"({date.fromordinal(self.base)} - {date.fromordinal(self.base + self.days)})")
+        return a - self.base, b - self.base
+
+    def _values(self):
+        nz = np.flatnonzero(self.arr)
+        return {self.base + int(i): int(self.arr[i]) for i in nz}
+
+    def domain(self):
+        return self.base, self.base + self.days
+
+    def range_max(self, a, b):
+        l, r = self._clip(a, b)
+        if l >= r:
+            return 0
+        m = int(self.arr[l:r].max())
+        return max(m, 0) if (l, r) != (a - self.base, b - self.base) else m
+
+    def range_add(self, a, b, x):
+        if b <= a:
+            return
+        l, r = self._writable(a, b)
+        with self.lock:
+            self.arr[l:r] += x
+
+    def counts(self, a, b):
+        if b <= a:
+            return []
+        l, r = self._clip(a, b)
+        if l >= r:
+            return [0] * (b - a)
+        return [0] * (l - (a - self.base)) + self.arr[l:r].tolist() + [0] * ((b - self.base) - r)
+
+    def assign(self, a, values):
+        if not values:
+            return
+        l, r = self._writable(a, a + len(values))
+        with self.lock:
+            self.arr[l:r] = values
+
+class PoolInventory:
+    """
+    Occupazione per pool di capacità: una struttura per giorno (InventoryTree o
+    SharedInventory) per pool, tutte con lo stesso lock così una prenotazione
+    che occupa più pool li controlla e incrementa in un solo passo.
+    inv[pool] è la struttura del pool; matrix(a, b) l'occupazione pool x giorni.
+    """
+
+    def __init__(self, pools, make, lock):
+        self.lock = lock
+        self.pools = list(pools)
+        self.by_pool = {p: make(p) for p in self.pools}
+
+    def __getitem__(self, pool):
+        return self.by_pool[pool]
+
+    def matrix(self, a, b):
+        """Occupazione dei giorni [a, b) per ogni pool (righe in ordine self.pools), int64."""
+        with self.lock:
+            return np.array([self.by_pool[p].counts(a, b) for p in self.pools],
+                            dtype=np.int64).reshape(len(self.pools), max(b - a, 0))
 
 # ---------------------------
 #  Config prezzi / prodotto
 # ---------------------------
 ROOM_TYPES = {
-    "standard": {"base_price_per_night": 70.0,  "max_guests": 2},
-    "deluxe":   {"base_price_per_night": 95.0,  "max_guests": 3},
-    "family":   {"base_price_per_night": 120.0, "max_guests": 4},
+    "standard": {"base_price_per_night": 70.0,  "max_guests": 2, "capacity": 2, "car_category": "economy"},
+    "deluxe":   {"base_price_per_night": 95.0,  "max_guests": 3, "capacity": 2, "car_category": "economy"},
+    "family":   {"base_price_per_night": 120.0, "max_guests": 4, "capacity": 1, "car_category": "suv"},
 }
 
+# Flotta auto del pacchetto: "car_category" della tipologia è la categoria
+# preferita, ma ogni veicolo può servire ogni prenotazione (upgrade gratuito)
+FLEET = [
+    {"id": "AUTO-01", "category": "economy"},
+    {"id": "AUTO-02", "category": "economy"},
+    {"id": "AUTO-03", "category": "economy"},
+    {"id": "AUTO-04", "category": "suv"},
+    {"id": "AUTO-05", "category": "suv"},
+]
+
 PRODUCT = {
     "id": "sicily-stay-car-01",
     "name": "Sicily Starter Pack (Alloggio + Auto)",
     "min_stay_nights": 2,
     "blackout_dates": ["2025-08-15"],
-    "capacity_per_day": 5
+    "shared_pools": {"auto": len(FLEET)}   # capacità comune a tutte le tipologie (flotta auto)
 }
 
 SEASON_FACTORS = [
@@ -95,113 +518,2265 @@ SEASON_FACTORS = [
     {"from": "2025-12-20", "to": "2026-01-06", "factor": 1.20},   # festivo
 ]
 
-ADVANCE_TIERS = [
-    {"days": 120, "discount": 0.10},
-    {"days": 60,  "discount": 0.06},
-    {"days": 30,  "discount": 0.03},
-]
+ADVANCE_TIERS = [
+    {"days": 120, "discount": 0.10},
+    {"days": 60,  "discount": 0.06},
+    {"days": 30,  "discount": 0.03},
+]
+
+COUPONS = {"WELCOME10": 0.10, "STUDENT5": 0.05}
+
+# Pool di capacità: uno per tipologia con "capacity", più i pool condivisi da
+# tutte le tipologie (PRODUCT["shared_pools"]). Una prenotazione occupa un posto
+# in ogni pool della sua tipologia (ROOM_POOLS). ROOM_POOL_MASK (tipologie x
+# pool, righe in ordine ROOM_TYPES) permette di calcolare i posti liberi di tutte
+# le tipologie con una sola operazione sulla matrice pool x giorni.
+POOLS = {**{rt: cfg["capacity"] for rt, cfg in ROOM_TYPES.items() if "capacity" in cfg},
+         **PRODUCT.get("shared_pools", {})}
+POOL_NAMES = list(POOLS)
+POOL_CAPS = np.array([POOLS[p] for p in POOL_NAMES], dtype=np.int64)
+ROOM_POOLS = {rt: [p for p in POOL_NAMES if p == rt or p in PRODUCT.get("shared_pools", {})]
+              for rt in ROOM_TYPES}
+ROOM_POOL_MASK = np.array([[p in ROOM_POOLS[rt] for p in POOL_NAMES] for rt in ROOM_TYPES],
+                          dtype=bool).reshape(len(ROOM_TYPES), len(POOL_NAMES))
+
+# Occupazione per pool e giorno: in memoria del processo, o in shared memory tra
+# i worker (INVENTORY_SHM_NAME, un segmento per pool); con DATABASE_URL fa fede
+# la tabella inventory
+if INVENTORY_SHM_NAME and not DATABASE_URL:
+    _snap_root, _snap_ext = os.path.splitext(INVENTORY_SNAPSHOT)
+    _shm_lock = _ProcessLock(os.path.join(os.path.dirname(os.path.abspath(INVENTORY_SNAPSHOT or INVENTORY_SHM_NAME)),
+                                          f".{INVENTORY_SHM_NAME}.lock"))
+    BOOKINGS = PoolInventory(POOL_NAMES, lambda p: SharedInventory(
+        f"{INVENTORY_SHM_NAME}-{p}", INVENTORY_SHM_DAYS,
+        f"{_snap_root}.{p}{_snap_ext}" if INVENTORY_SNAPSHOT else None, lock=_shm_lock), _shm_lock)
+else:
+    _tree_lock = threading.RLock()
+    BOOKINGS = PoolInventory(POOL_NAMES, lambda p: InventoryTree(lock=_tree_lock), _tree_lock)
+# occupazione scritta anche da altri processi (DB o shared memory): le cache locali scadono
+BOOKINGS_SHARED = bool(engine or INVENTORY_SHM_NAME)
+
+# ---------------------------
+#  Util
+# ---------------------------
+def parse_date(s: str):
+    """Accetta 'YYYY-MM-DD' o 'DD/MM/YYYY' e ritorna date()."""
+    return _parse_date_str((s or "").strip())
+
+@lru_cache(maxsize=4096)
+def _parse_date_str(s):
+    # fast path per le forme canoniche a 10 caratteri; il resto (es. '2025-6-1')
+    # passa da strptime come prima, con lo stesso messaggio d'errore
+    if len(s) == 10 and s.isascii():
+        try:
+            if s[4] == "-" and s[7] == "-" and s[:4].isdigit() and s[5:7].isdigit() and s[8:].isdigit():
+                return date.fromisoformat(s)
+            if s[2] == "/" and s[5] == "/" and s[:2].isdigit() and s[3:5].isdigit() and s[6:].isdigit():
+                return date(int(s[6:]), int(s[3:5]), int(s[:2]))
+        except ValueError:
+            pass
+    return _parse_date_strptime(s)
+
+def _parse_date_strptime(s):
+    """Parsing originale (solo strptime): fallback del fast path e riferimento di parse_date_report()."""
+    for fmt in ("%Y-%m-%d", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(s, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Data non valida: '{s}'. Usa formato YYYY-MM-DD o DD/MM/YYYY")
+
+def optional_str(data, key):
+    """data[key] se è una stringa, None se manca o è null; ValueError per gli altri tipi (es. liste)."""
+    value = data.get(key)
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f"'{key}' deve essere una stringa")
+    return value
+
+def parse_date_report(n=20000, iso_share=0.7, days=400, seed=7):
+    """
+    Micro-benchmark di parse_date(): strptime (vecchio) contro fast path, senza
+    e con memoizzazione, su n date miste ISO / DD/MM/YYYY di check-in e check-out
+    nei prossimi `days` giorni (molte ripetute, come nel traffico reale).
+    """
+    rnd = np.random.default_rng(seed)
+    base = datetime.utcnow().date().toordinal()
+    sample = [d.isoformat() if iso else d.strftime("%d/%m/%Y")
+              for d, iso in zip(map(date.fromordinal, (base + rnd.integers(0, days, n)).tolist()),
+                                rnd.random(n) < iso_share)]
+
+    timings = {}
+    results = {}
+    for name, fn in (("strptime", _parse_date_strptime),
+                     ("fast", _parse_date_str.__wrapped__),
+                     ("fast_cached", parse_date)):
+        t0 = time.perf_counter()
+        results[name] = [fn(s) for s in sample]
+        timings[name] = round((time.perf_counter() - t0) * 1000, 2)
+    return {
+        "dates": n,
+        "distinct": len(set(sample)),
+        "iso_share": iso_share,
+        "equal": results["fast"] == results["strptime"] == results["fast_cached"],
+        "ms": timings,
+        "speedup": {k: round(timings["strptime"] / max(v, 1e-3), 1)
+                    for k, v in timings.items() if k != "strptime"},
+    }
+
+def daterange(d1, d2):
+    cur = d1
+    while cur < d2:
+        yield cur
+        cur += timedelta(days=1)
+
+def is_blackout(d):
+    cal = CALENDAR
+    i = d.toordinal() - cal["blackout_base"]
+    return i >= 0 and (cal["blackout_bits"] >> i) & 1 == 1
+
+def season_factor(d):
+    cal = CALENDAR
+    i = d.toordinal() - cal["start"]
+    if 0 <= i < len(cal["factors"]):
+        return cal["factors"][i]
+    return 1.0
+
+def advance_discount(today, checkin):
+    days = (checkin - today).days
+    for tier in ADVANCE_TIERS:
+        if days >= tier["days"]:
+            return tier["discount"]
+    return 0.0
+
+def valid_capacity(d, room_type="standard"):
+    return first_full_day(room_type, d, d + timedelta(days=1)) is None
+
+# ---------------------------
+#  Calendario prezzi compilato
+# ---------------------------
+# Tabelle derivate dalla config (SEASON_FACTORS, ROOM_TYPES), indicizzate per
+# ordinale di data a partire da CALENDAR["start"]. Fuori dall'intervallo
+# compilato non ci sono stagioni: fattore 1.0, tariffa = prezzo base.
+# "cumulative"[rt][i] = somma delle tariffe dei primi i giorni (somme prefisse).
+# Per il calcolo vettoriale: "rt_names" (ordine delle righe), "cumulative_np"
+# (matrice tipologie x giorni+1), "base_np" e "max_guests_np".
+# "cents": le stesse tabelle in interi (centesimi / punti base) per PRICING_MODE=cents.
+# Blackout (PRODUCT["blackout_dates"]): bitmap in un intero Python, bit i = giorno
+# blackout_base + i; "blackout_np" sono gli stessi ordinali ordinati, per i batch.
+CALENDAR = {"start": 0, "factors": [], "rates": {}, "cumulative": {},
+            "blackout_base": 0, "blackout_bits": 0}
+
+def compile_calendar():
+    """Compila SEASON_FACTORS in fattori/tariffe per notte (una sola volta, non per preventivo)."""
+    global CALENDAR
+    spans = [(parse_date(s["from"]).toordinal(), parse_date(s["to"]).toordinal(), s["factor"])
+             for s in SEASON_FACTORS]
+    start = min((a for a, _, _ in spans), default=0)
+    end = max((b + 1 for _, b, _ in spans), default=start)
+    factors = [1.0] * (end - start)
+    # a parità di giorno vince la prima stagione in lista (come nello scan originale)
+    for a, b, f in reversed(spans):
+        if a <= b:
+            factors[a - start:b + 1 - start] = [f] * (b + 1 - a)
+    rates = {rt: [cfg["base_price_per_night"] * f for f in factors]
+             for rt, cfg in ROOM_TYPES.items()}
+    cumulative = {rt: [0.0, *accumulate(r)] for rt, r in rates.items()}
+    rt_names = list(ROOM_TYPES)
+    blackout = sorted({parse_date(x).toordinal() for x in PRODUCT["blackout_dates"]})
+    blackout_base = blackout[0] if blackout else 0
+    blackout_bits = 0
+    for o in blackout:
+        blackout_bits |= 1 << (o - blackout_base)
+    CALENDAR = {
+        "start": start, "factors": factors, "rates": rates, "cumulative": cumulative,
+        "rt_names": rt_names,
+        "cumulative_np": np.array([cumulative[rt] for rt in rt_names], dtype=np.float64).reshape(len(rt_names), -1),
+        "base_np": np.array([ROOM_TYPES[rt]["base_price_per_night"] for rt in rt_names], dtype=np.float64),
+        "max_guests_np": np.array([ROOM_TYPES[rt]["max_guests"] for rt in rt_names], dtype=np.int64),
+        "cents": _compile_cents(start, end, spans, rt_names),
+        "blackout_base": blackout_base,
+        "blackout_bits": blackout_bits,
+        "blackout_np": np.array(blackout, dtype=np.int64),
+    }
+
+def first_blackout(checkin, checkout):
+    """Prima notte di blackout in [checkin, checkout), o None: una sola operazione sul bitmap."""
+    cal = CALENDAR
+    bits = cal["blackout_bits"]
+    a = max(checkin.toordinal() - cal["blackout_base"], 0)
+    b = checkout.toordinal() - cal["blackout_base"]
+    if not bits or b <= a:
+        return None
+    window = (bits >> a) & ((1 << (b - a)) - 1)
+    if not window:
+        return None
+    return date.fromordinal(cal["blackout_base"] + a + (window & -window).bit_length() - 1)
+
+def blackout_flags(start, end):
+    """Per ogni giorno di [start, end), True se è blackout (uno shift del bitmap)."""
+    cal = CALENDAR
+    a = start.toordinal() - cal["blackout_base"]
+    window = cal["blackout_bits"] >> a if a >= 0 else cal["blackout_bits"] << -a
+    return [(window >> i) & 1 == 1 for i in range((end - start).days)]
+
+# ---------------------------
+#  Prezzi in interi (centesimi e punti base)
+# ---------------------------
+# Con PRICING_MODE=cents ogni tariffa è in centesimi e ogni fattore/sconto in
+# punti base (1 bp = 0,01%). Regole di arrotondamento, tutte half-up al centesimo:
+#   1. tariffa notte = base * fattore stagione
+#   2. totale notti  = somma esatta delle tariffe notte
+#   3. supplemento ospiti, 4. sconto anticipo, 5. coupon: uno step ciascuno.
+GUEST_SURCHARGE_BP = 1000  # +10% per ospite oltre 2 (come guest_surcharge)
+
+def to_units(x, scale):
+    """Converte un valore di config (euro, fattore, sconto) in intero: to_units(1.25, 10000) == 12500."""
+    return int((Decimal(str(x)) * scale).to_integral_value(ROUND_HALF_UP))
+
+def half_up_div(n, d):
+    """n / d arrotondato half-up per n >= 0, d > 0 (interi Python o array int64)."""
+    return (2 * n + d) // (2 * d)
+
+def _compile_cents(start, end, spans, rt_names):
+    factors_bp = [10000] * (end - start)
+    for a, b, f in reversed(spans):
+        if a <= b:
+            factors_bp[a - start:b + 1 - start] = [to_units(f, 10000)] * (b + 1 - a)
+    base = {rt: to_units(ROOM_TYPES[rt]["base_price_per_night"], 100) for rt in rt_names}
+    cumulative = {rt: [0, *accumulate(half_up_div(base[rt] * f, 10000) for f in factors_bp)]
+                  for rt in rt_names}
+    return {
+        "base": base,
+        "cumulative": cumulative,
+        "cumulative_np": np.array([cumulative[rt] for rt in rt_names], dtype=np.int64).reshape(len(rt_names), -1),
+        "base_np": np.array([base[rt] for rt in rt_names], dtype=np.int64),
+        "advance_bp": [(t["days"], to_units(t["discount"], 10000)) for t in ADVANCE_TIERS],
+        "coupons_bp": {code: to_units(v, 10000) for code, v in COUPONS.items()},
+    }
+
+def stay_base_cents(room_type, checkin, checkout):
+    """Come stay_base_total() ma in centesimi interi (esatto, nessun errore di somma)."""
+    cal = CALENDAR
+    cc = cal["cents"]
+    cum = cc["cumulative"][room_type]
+    n = len(cal["factors"])
+    a = checkin.toordinal() - cal["start"]
+    b = checkout.toordinal() - cal["start"]
+    ca, cb = min(max(a, 0), n), min(max(b, 0), n)
+    return cum[cb] - cum[ca] + cc["base"][room_type] * ((b - a) - (cb - ca))
+
+def guest_surcharge_cents(cents, guests):
+    if guests > 2:
+        cents = half_up_div(cents * (10000 + GUEST_SURCHARGE_BP * (guests - 2)), 10000)
+    return cents
+
+def apply_discounts_cents(cents, checkin, today, coupon):
+    """Sconto anticipo e coupon in punti base, ciascuno arrotondato half-up al centesimo."""
+    cc = CALENDAR["cents"]
+    days = (checkin - today).days
+    for tier_days, bp in cc["advance_bp"]:
+        if days >= tier_days:
+            cents = half_up_div(cents * (10000 - bp), 10000)
+            break
+    if coupon and coupon in cc["coupons_bp"]:
+        cents = half_up_div(cents * (10000 - cc["coupons_bp"][coupon]), 10000)
+    return cents
+
+def nightly_rate(room_type, d):
+    """Tariffa della notte d per la tipologia (prezzo base * fattore stagionale)."""
+    cal = CALENDAR
+    i = d.toordinal() - cal["start"]
+    if 0 <= i < len(cal["factors"]):
+        return cal["rates"][room_type][i]
+    return ROOM_TYPES[room_type]["base_price_per_night"]
+
+def nightly_rates(room_type, start, end):
+    """Tariffe delle notti [start, end) con una slice del calendario compilato (euro, da centesimi con PRICING_MODE=cents)."""
+    cal = CALENDAR
+    n = len(cal["factors"])
+    a = start.toordinal() - cal["start"]
+    b = end.toordinal() - cal["start"]
+    lo = min(max(a, 0), n)
+    hi = max(min(b, n), lo)
+    left = max(0, min(lo, b) - a)     # notti prima del calendario compilato
+    right = b - a - left - (hi - lo)  # notti dopo
+    if PRICING_MODE == "cents":
+        cc = cal["cents"]
+        cum = cc["cumulative"][room_type][lo:hi + 1]
+        base = cc["base"][room_type]
+        return [c / 100 for c in [base] * left + [y - x for x, y in zip(cum, cum[1:])] + [base] * right]
+    base = ROOM_TYPES[room_type]["base_price_per_night"]
+    return [base] * left + cal["rates"][room_type][lo:hi] + [base] * right
+
+def stay_base_total(room_type, checkin, checkout):
+    """Somma delle tariffe su [checkin, checkout): due lookup nelle somme prefisse, O(1)."""
+    cal = CALENDAR
+    cum = cal["cumulative"][room_type]
+    n = len(cal["factors"])
+    a = checkin.toordinal() - cal["start"]
+    b = checkout.toordinal() - cal["start"]
+    ca, cb = min(max(a, 0), n), min(max(b, 0), n)
+    total = cum[cb] - cum[ca]
+    outside = (b - a) - (cb - ca)  # notti fuori dal calendario: tariffa base
+    if outside:
+        total += ROOM_TYPES[room_type]["base_price_per_night"] * outside
+    return total
+
+def stay_base_total_sequential(room_type, checkin, checkout):
+    """Come stay_base_total ma accumulando notte per notte (riferimento esatto)."""
+    total = 0.0
+    for d in daterange(checkin, checkout):
+        total += nightly_rate(room_type, d)
+    return total
+
+def reload_pricing_config():
+    """Ricostruisce le strutture derivate dalla config prezzi: chiamare dopo ogni modifica."""
+    compile_calendar()
+    refresh_quote_tensor()
+    clear_quote_cache()
+
+# ---------------------------
+#  Tensore preventivi (orizzonte prenotabile)
+# ---------------------------
+# data[tipologia, ospiti-1, offset check-in, notti] = totale notti con supplemento
+# ospiti, cioè il prezzo di quote_price() prima di sconto anticipo e coupon.
+# Non dipende da "today": today sposta solo l'origine "start" della finestra.
+QUOTE_TENSOR = {"start": 0, "calendar": None, "data": None, "rt_index": {}}
+_QUOTE_TENSOR_LOCK = threading.Lock()
+
+def _quote_tensor_block(cal, start, count):
+    """Blocco del tensore per i check-in [start, start+count) (float64, o int64 centesimi in modalità cents)."""
+    ci = np.arange(start, start + count, dtype=np.int64)[:, None]
+    co = ci + np.arange(QUOTE_TENSOR_MAX_NIGHTS + 1, dtype=np.int64)[None, :]
+    n_days = len(cal["factors"])
+    a, b = ci - cal["start"], co - cal["start"]
+    ca, cb = np.clip(a, 0, n_days), np.clip(b, 0, n_days)
+    g = np.arange(1, int(cal["max_guests_np"].max(initial=0)) + 1)
+    if PRICING_MODE == "cents":
+        cc = cal["cents"]
+        cum = cc["cumulative_np"]
+        nights_total = (cum[:, cb] - cum[:, ca]) + cc["base_np"][:, None, None] * ((b - a) - (cb - ca))
+        surcharge_bp = 10000 + GUEST_SURCHARGE_BP * np.maximum(g - 2, 0)
+        return half_up_div(nights_total[:, None, :, :] * surcharge_bp[None, :, None, None], 10000)
+    cum = cal["cumulative_np"]
+    # stesse operazioni float di stay_base_total() e guest_surcharge()
+    nights_total = (cum[:, cb] - cum[:, ca]) + cal["base_np"][:, None, None] * ((b - a) - (cb - ca))
+    surcharge = np.where(g > 2, 1 + 0.10 * (g - 2), 1.0)
+    return nights_total[:, None, :, :] * surcharge[None, :, None, None]
+
+def refresh_quote_tensor(today=None):
+    """
+    Allinea il tensore a today e alla config corrente. Se cambia solo il giorno
+    si fa scorrere la finestra e si calcolano i soli check-in nuovi; se è
+    cambiata la config (CALENDAR ricompilato) si ricostruisce tutto.
+    """
+    global QUOTE_TENSOR
+    if QUOTE_HORIZON_DAYS <= 0:
+        return
+    start = (today or datetime.utcnow().date()).toordinal()
+    with _QUOTE_TENSOR_LOCK:
+        old, cal = QUOTE_TENSOR, CALENDAR
+        shift = start - old["start"]
+        if old["calendar"] is cal and shift == 0:
+            return
+        if old["calendar"] is cal and 0 < shift < QUOTE_HORIZON_DAYS:
+            keep = QUOTE_HORIZON_DAYS - shift
+            data = np.empty_like(old["data"])
+            data[:, :, :keep] = old["data"][:, :, shift:]
+            data[:, :, keep:] = _quote_tensor_block(cal, start + keep, shift)
+        else:
+            data = _quote_tensor_block(cal, start, QUOTE_HORIZON_DAYS)
+        QUOTE_TENSOR = {"start": start, "calendar": cal, "data": data,
+                        "rt_index": {rt: i for i, rt in enumerate(cal["rt_names"])}}
+    app.logger.info(f"Tensore preventivi da {date.fromordinal(start)}: shape {data.shape}, "
+                    f"{data.nbytes / 1024:.0f} KiB")
+
+# ---------------------------
+#  Preventivo
+# ---------------------------
+def guest_surcharge(total, guests):
+    if guests > 2:
+        total *= (1 + 0.10 * (guests - 2))  # +10% per ospite oltre 2
+    return total
+
+def apply_discounts(total, checkin, today, coupon):
+    """Applica sconto anticipo e coupon al totale già comprensivo di supplemento ospiti."""
+    total *= (1 - advance_discount(today, checkin))
+
+    if coupon and coupon in COUPONS:
+        total *= (1 - COUPONS[coupon])
+    return total
+
+def applied_coupon(coupon):
+    """Il coupon come va salvato sulla prenotazione: None se non dà sconto."""
+    return coupon if coupon in COUPONS else None
+
+def apply_price_rules(total, guests, checkin, today, coupon):
+    """Applica al totale notti: supplemento ospiti, sconto anticipo, coupon."""
+    return apply_discounts(guest_surcharge(total, guests), checkin, today, coupon)
+
+def pre_discount_total(room_type, checkin, checkout, guests):
+    """
+    Totale notti con supplemento ospiti: gather dal tensore se nell'orizzonte,
+    altrimenti somme prefisse. Euro float, o centesimi int con PRICING_MODE=cents.
+    """
+    t = QUOTE_TENSOR
+    off = checkin.toordinal() - t["start"]
+    nights = (checkout - checkin).days
+    if t["data"] is not None and 0 <= off < QUOTE_HORIZON_DAYS and nights <= QUOTE_TENSOR_MAX_NIGHTS:
+        return t["data"][t["rt_index"][room_type], guests - 1, off, nights].item()
+    if PRICING_MODE == "cents":
+        return guest_surcharge_cents(stay_base_cents(room_type, checkin, checkout), guests)
+    return guest_surcharge(stay_base_total(room_type, checkin, checkout), guests)
+
+def near_rounding_tie(total, eps=1e-6):
+    """True se total è a meno di eps centesimi da un mezzo centesimo."""
+    frac = (total * 100) % 1.0
+    return abs(frac - 0.5) < eps
+
+# Codici errore di quote_price_batch e quote_price_all (stesso ordine dei controlli di quote_price)
+QUOTE_OK             = 0
+QUOTE_ERR_ROOM_TYPE  = 1
+QUOTE_ERR_GUESTS     = 2
+QUOTE_ERR_MIN_STAY   = 3
+QUOTE_ERR_BLACKOUT   = 4
+QUOTE_ERR_CAPACITY   = 5
+QUOTE_ERR_HORIZON    = 6
+QUOTE_ERR_REASONS = {QUOTE_ERR_ROOM_TYPE: "room_type", QUOTE_ERR_GUESTS: "guests",
+                     QUOTE_ERR_MIN_STAY: "min_stay", QUOTE_ERR_BLACKOUT: "blackout",
+                     QUOTE_ERR_CAPACITY: "capacity", QUOTE_ERR_HORIZON: "horizon"}
+
+def bookable_window():
+    """Ordinali [primo check-in, ultimo check-out] prenotabili: da ieri (fusi orari) a oggi + BOOKING_HORIZON_DAYS."""
+    today = datetime.utcnow().date().toordinal()
+    return today - 1, today + BOOKING_HORIZON_DAYS
+
+def _stay_window_error(checkin, checkout):
+    first, last = bookable_window()
+    if checkin.toordinal() < first or checkout.toordinal() > last:
+        return (QUOTE_ERR_HORIZON, f"Date fuori dal periodo prenotabile: check-in dal "
+                                   f"{date.fromordinal(first)}, check-out entro il {date.fromordinal(last)}")
+    if (checkout - checkin).days < PRODUCT["min_stay_nights"]:
+        return (QUOTE_ERR_MIN_STAY, f"Soggiorno minimo {PRODUCT['min_stay_nights']} notti")
+    return None
+
+def stay_unavailable(checkin, checkout, room_type):
+    """
+    Controlli sul soggiorno che non dipendono dagli ospiti: periodo prenotabile,
+    soggiorno minimo, capacità (pool della tipologia), blackout. Ritorna (codice QUOTE_ERR_*, messaggio) o None.
+    """
+    err = _stay_window_error(checkin, checkout)
+    if err:
+        return err
+
+    # vince la prima notte non disponibile; a parità il blackout precede la capacità
+    blackout = first_blackout(checkin, checkout)
+    full = first_full_day(room_type, checkin, blackout or checkout)
+    if full:
+        return (QUOTE_ERR_CAPACITY, f"Capacità esaurita nel giorno: {full}")
+    if blackout:
+        return (QUOTE_ERR_BLACKOUT, f"Data non disponibile: {blackout}")
+    return None
+
+def quote_price(checkin, checkout, guests, *, coupon=None, today=None, room_type="standard"):
+    room_type = (room_type or "standard").lower()
+    if room_type not in ROOM_TYPES:
+        return (False, f"Tipologia camera non valida: {room_type}", None)
+
+    RT = ROOM_TYPES[room_type]
+    if guests < 1 or guests > RT["max_guests"]:
+        return (False, f"Ospiti non validi per {room_type} (max {RT['max_guests']})", None)
+
+    unavailable = stay_unavailable(checkin, checkout, room_type)
+    if unavailable:
+        return (False, unavailable[1], None)
+    return (True, "ok", stay_price(room_type, checkin, checkout, guests, today=today, coupon=coupon))
+
+def quote_price_all(checkin, checkout, guests, *, coupon=None, today=None):
+    """
+    quote_price() per tutte le tipologie che accettano 'guests', con i controlli
+    sul soggiorno fatti una volta sola: soggiorno minimo e blackout in comune,
+    capacità di tutte le tipologie da una sola lettura (inventory_free). Ritorna
+    {tipologia: (ok, codice QUOTE_*, msg, prezzo)}, stessi esiti di quote_price().
+    """
+    common = _stay_window_error(checkin, checkout)
+    if not common:
+        blackout = first_blackout(checkin, checkout)
+        end = blackout or checkout
+        full = inventory_free(checkin, end) <= 0   # tipologie x notti
+    out = {}
+    for i, (rt, cfg) in enumerate(ROOM_TYPES.items()):
+        if not 1 <= guests <= cfg["max_guests"]:
+            continue
+        unavailable = common
+        if not common:
+            nights_full = np.flatnonzero(full[i])
+            if nights_full.size:
+                unavailable = (QUOTE_ERR_CAPACITY, f"Capacità esaurita nel giorno: "
+                                                   f"{checkin + timedelta(days=int(nights_full[0]))}")
+            elif blackout:
+                unavailable = (QUOTE_ERR_BLACKOUT, f"Data non disponibile: {blackout}")
+        if unavailable:
+            out[rt] = (False, *unavailable, None)
+        else:
+            out[rt] = (True, QUOTE_OK, "ok", stay_price(rt, checkin, checkout, guests, today=today, coupon=coupon))
+    return out
+
+def stay_price(room_type, checkin, checkout, guests, *, today=None, coupon=None):
+    """Prezzo finale del soggiorno (regole di quote_price), senza controlli di disponibilità."""
+    # il tensore (totali prima degli sconti) non dipende da today: la finestra
+    # segue il giorno corrente anche quando il chiamante passa il suo today
+    current = datetime.utcnow().date()
+    if current.toordinal() != QUOTE_TENSOR["start"] or QUOTE_TENSOR["calendar"] is not CALENDAR:
+        refresh_quote_tensor(current)
+    today = today or current
+
+    if PRICING_MODE == "cents":
+        cents = apply_discounts_cents(pre_discount_total(room_type, checkin, checkout, guests),
+                                      checkin, today, coupon)
+        return cents / 100
+
+    total = apply_discounts(pre_discount_total(room_type, checkin, checkout, guests),
+                            checkin, today, coupon)
+    if near_rounding_tie(total):
+        # la differenza di somme prefisse può scostarsi di un ulp dall'accumulo notte
+        # per notte: vicino al mezzo centesimo si ricalcola per arrotondare identico
+        total = apply_price_rules(stay_base_total_sequential(room_type, checkin, checkout),
+                                  guests, checkin, today, coupon)
+    return round(total, 2)
+
+def _first_at_or_after(sorted_ords, ords):
+    """Per ogni ordinale in ords, il primo valore di sorted_ords >= ordinale (o un sentinella enorme)."""
+    if not len(sorted_ords):
+        return np.full(ords.shape, np.iinfo(np.int64).max, dtype=np.int64)
+    padded = np.append(sorted_ords, np.iinfo(np.int64).max)
+    return padded[np.searchsorted(sorted_ords, ords)]
+
+def quote_price_batch(checkin, checkout, guests, room_types, coupons=None, *, today=None, mode=None):
+    """
+    Versione vettoriale di quote_price() per feed partner e controlli di parità.
+    checkin/checkout sono ordinali di data (date.toordinal()), guests interi,
+    room_types e coupons sequenze di stringhe (o None). Ritorna (prezzi, codici):
+    prezzi float64 arrotondati al centesimo (NaN se errore), codici QUOTE_*.
+    I prezzi coincidono con quelli di quote_price() sugli stessi input.
+    mode ("float"/"cents") forza il motore di calcolo, default PRICING_MODE.
+    """
+    mode = mode or PRICING_MODE
+    cal = CALENDAR
+    ci = np.asarray(checkin, dtype=np.int64)
+    co = np.asarray(checkout, dtype=np.int64)
+    g = np.asarray(guests, dtype=np.int64)
+    size = ci.shape[0]
+    if not today:
+        today = datetime.utcnow().date()
+
+    # tipologie e coupon -> indici/sconti (un lookup per valore distinto)
+    rt_pos = {rt: i for i, rt in enumerate(cal["rt_names"])}
+    rt_memo = {}
+    def _rt_code(r):
+        if r not in rt_memo:
+            rt_memo[r] = rt_pos.get((r or "standard").lower(), -1)
+        return rt_memo[r]
+    rt = np.fromiter((_rt_code(r) for r in room_types), dtype=np.int64, count=size)
+    coupon_table, dtype = (cal["cents"]["coupons_bp"], np.int64) if mode == "cents" else (COUPONS, np.float64)
+    if coupons is None:
+        cpn = np.zeros(size, dtype=dtype)
+    else:
+        cpn = np.fromiter((coupon_table[c] if c and c in coupon_table else 0 for c in coupons),
+                          dtype=dtype, count=size)
+
+    valid_rt = rt >= 0
+    rti = np.where(valid_rt, rt, 0)
+    nights = co - ci
+
+    # notte non disponibile più vicina al check-in (blackout e capacità della tipologia)
+    blackout = cal["blackout_np"]
+    first_blackout = _first_at_or_after(blackout, ci)
+    first_full = np.full(size, np.iinfo(np.int64).max, dtype=np.int64)
+    first, last = bookable_window()
+    in_horizon = (ci >= first) & (co <= last)
+    stay = (ci < co) & in_horizon
+    if stay.any():
+        for t, full in enumerate(inventory_full_days(int(ci[stay].min()), int(co[stay].max()))):
+            sel = np.flatnonzero(valid_rt & (rti == t))
+            if len(full) and len(sel):
+                first_full[sel] = _first_at_or_after(full, ci[sel])
+
+    codes = np.select(
+        [~valid_rt,
+         (g < 1) | (g > cal["max_guests_np"][rti]),
+         ~in_horizon,
+         nights < PRODUCT["min_stay_nights"],
+         (first_blackout < co) & (first_blackout <= first_full),
+         first_full < co],
+        [QUOTE_ERR_ROOM_TYPE, QUOTE_ERR_GUESTS, QUOTE_ERR_HORIZON, QUOTE_ERR_MIN_STAY,
+         QUOTE_ERR_BLACKOUT, QUOTE_ERR_CAPACITY],
+        default=QUOTE_OK,
+    ).astype(np.int8)
+
+    # notti: somme prefisse (fuori calendario tariffa base), come stay_base_total()
+    n_days = len(cal["factors"])
+    a = ci - cal["start"]
+    b = co - cal["start"]
+    ca, cb = np.clip(a, 0, n_days), np.clip(b, 0, n_days)
+    days_ahead = ci - today.toordinal()
+
+    if mode == "cents":
+        # stessi step di guest_surcharge_cents() e apply_discounts_cents()
+        cc = cal["cents"]
+        cum = cc["cumulative_np"]
+        total = (cum[rti, cb] - cum[rti, ca]) + cc["base_np"][rti] * ((b - a) - (cb - ca))
+        total = half_up_div(total * (10000 + GUEST_SURCHARGE_BP * np.maximum(g - 2, 0)), 10000)
+        adv_bp = np.zeros(size, dtype=np.int64)
+        for tier_days, bp in reversed(cc["advance_bp"]):
+            adv_bp = np.where(days_ahead >= tier_days, bp, adv_bp)
+        total = half_up_div(total * (10000 - adv_bp), 10000)
+        total = half_up_div(total * (10000 - cpn), 10000)
+        prices = total / 100
+        prices[codes != QUOTE_OK] = np.nan
+        return prices, codes
+
+    cum = cal["cumulative_np"]
+    total = (cum[rti, cb] - cum[rti, ca]) + cal["base_np"][rti] * ((b - a) - (cb - ca))
+
+    # supplemento ospiti, sconto anticipo, coupon: stesse operazioni di apply_price_rules()
+    total *= np.where(g > 2, 1 + 0.10 * (g - 2), 1.0)
+    adv = np.zeros(size, dtype=np.float64)
+    for tier in reversed(ADVANCE_TIERS):
+        adv = np.where(days_ahead >= tier["days"], tier["discount"], adv)
+    total *= (1 - adv)
+    total *= (1 - cpn)
+
+    prices = np.round(total, 2)
+    # vicino al mezzo centesimo si delega al percorso scalare per arrotondare identico
+    frac = (total * 100) % 1.0
+    tie = np.flatnonzero((codes == QUOTE_OK) & (np.abs(frac - 0.5) < 1e-6))
+    for i in tie:
+        rt_name = cal["rt_names"][rti[i]]
+        d_in, d_out = date.fromordinal(int(ci[i])), date.fromordinal(int(co[i]))
+        coupon = coupons[i] if coupons is not None else None
+        prices[i] = round(apply_price_rules(stay_base_total_sequential(rt_name, d_in, d_out),
+                                            int(g[i]), d_in, today, coupon), 2)
+    prices[codes != QUOTE_OK] = np.nan
+    return prices, codes
+
+def cheapest_stays(start, end, min_nights, max_nights, guests, room_types=None, *,
+                   coupon=None, k=10, today=None):
+    """
+    I k soggiorni prenotabili più economici con check-in >= start e checkout
+    <= end, da min_nights a max_nights notti, per le tipologie indicate (default
+    tutte quelle che accettano 'guests'). Tutte le combinazioni passano da un
+    solo quote_price_batch() (somme prefisse, stesse regole di quote_price());
+    la selezione dei primi k è un heap. Ritorna dict ordinati per prezzo.
+    """
+    rt_names = [rt for rt in (room_types or ROOM_TYPES) if 1 <= guests <= ROOM_TYPES[rt]["max_guests"]]
+    a, b = start.toordinal(), end.toordinal()
+    # nessun soggiorno più lungo della finestra: limita la griglia check-in x notti
+    nights = np.arange(max(min_nights, PRODUCT["min_stay_nights"], 1), min(max_nights, b - a) + 1, dtype=np.int64)
+    ci = np.arange(a, b, dtype=np.int64)
+    ci, nights = (x.ravel() for x in np.meshgrid(ci, nights, indexing="ij"))
+    keep = ci + nights <= b
+    ci, co = ci[keep], ci[keep] + nights[keep]
+    if not rt_names or not len(ci):
+        return []
+    m = len(ci)
+    prices, codes = quote_price_batch(np.tile(ci, len(rt_names)), np.tile(co, len(rt_names)),
+                                      np.full(m * len(rt_names), guests),
+                                      [rt for rt in rt_names for _ in range(m)],
+                                      None if not coupon else [coupon] * (m * len(rt_names)),
+                                      today=today)
+    ok = np.flatnonzero(codes == QUOTE_OK)
+    # a parità di prezzo: check-in prima, poi soggiorno più corto, poi ordine tipologie
+    best = heapq.nsmallest(k, zip(prices[ok].tolist(), ci[ok % m].tolist(),
+                                  (co[ok % m] - ci[ok % m]).tolist(), (ok // m).tolist()))
+    return [{"checkin": date.fromordinal(d).isoformat(),
+             "checkout": date.fromordinal(d + n).isoformat(),
+             "nights": n, "room_type": rt_names[r], "total_price": price}
+            for price, d, n, r in best]
+
+def pricing_mode_report(today=None, nights=range(2, 15), days=None):
+    """
+    Confronta il motore float con quello a interi su tutte le combinazioni
+    tipologia x ospiti x check-in (prossimi `days` giorni) x notti x coupon.
+    Ritorna conteggi, distribuzione delle differenze in centesimi e tempi.
+    """
+    today = today or datetime.utcnow().date()
+    days = days or QUOTE_HORIZON_DAYS or 365
+    rows = [(rt, g, ci, n, cp)
+            for rt, cfg in ROOM_TYPES.items()
+            for g in range(1, cfg["max_guests"] + 1)
+            for cp in [None, *COUPONS]
+            for n in nights
+            for ci in range(today.toordinal(), today.toordinal() + days)]
+    rts, gs, cis, ns, cps = zip(*rows)
+    ci = np.array(cis, dtype=np.int64)
+    co = ci + np.array(ns, dtype=np.int64)
+
+    timings = {}
+    results = {}
+    for mode in ("float", "cents"):
+        t0 = time.perf_counter()
+        results[mode] = quote_price_batch(ci, co, gs, rts, cps, today=today, mode=mode)
+        timings[mode] = round((time.perf_counter() - t0) * 1000, 1)
+
+    (pf, cf), (pc, _) = results["float"], results["cents"]
+    ok = cf == QUOTE_OK
+    diff = np.rint((pc[ok] - pf[ok]) * 100).astype(np.int64)
+    values, counts = np.unique(diff, return_counts=True)
+    return {
+        "mode": PRICING_MODE,
+        "today": today.isoformat(),
+        "quotes": int(ok.sum()),
+        "equal": int((diff == 0).sum()),
+        "different": int((diff != 0).sum()),
+        "max_abs_diff_cents": int(np.abs(diff).max(initial=0)),
+        "diff_cents_histogram": {str(v): int(c) for v, c in zip(values, counts)},
+        "batch_ms": timings,
+    }
+
+# ---------------------------
+#  Cache preventivi
+# ---------------------------
+# LRU di risultati di quote_price() per (checkin, checkout, guests, room_type,
+# coupon, today). Ogni voce è indicizzata anche per notte, così una modifica
+# alla capacità di un giorno invalida solo i preventivi che lo includono.
+# Le modifiche alla config passano da reload_pricing_config(), che svuota tutto.
+# Con DB o shared memory le prenotazioni degli altri worker non passano di qui:
+# le voci valgono al massimo INVENTORY_CACHE_TTL secondi, come la cache di
+# lettura inventario.
+_QUOTE_CACHE = OrderedDict()              # key -> ((ok, msg, price), salvato_il)
+_QUOTE_CACHE_BY_DAY = defaultdict(set)    # ordinale notte -> keys
+_QUOTE_CACHE_LOCK = threading.Lock()
+_QUOTE_CACHE_GEN = [0]                    # incrementato a ogni invalidazione
+QUOTE_CACHE_STATS = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+def _quote_cache_unindex(key):
+    for o in range(key[0].toordinal(), key[1].toordinal()):
+        keys = _QUOTE_CACHE_BY_DAY.get(o)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del _QUOTE_CACHE_BY_DAY[o]
+
+def cached_quote_price(checkin, checkout, guests, *, coupon=None, today=None, room_type="standard"):
+    """quote_price() con cache LRU; stessa firma e stesso risultato."""
+    if QUOTE_CACHE_SIZE <= 0:
+        return quote_price(checkin, checkout, guests, coupon=coupon, today=today, room_type=room_type)
+    today = today or datetime.utcnow().date()
+    key = (checkin, checkout, guests, (room_type or "standard").lower(), coupon, today)
+    with _QUOTE_CACHE_LOCK:
+        hit = _QUOTE_CACHE.get(key)
+        if hit is not None and (not BOOKINGS_SHARED or time.monotonic() - hit[1] <= INVENTORY_CACHE_TTL):
+            _QUOTE_CACHE.move_to_end(key)
+            QUOTE_CACHE_STATS["hits"] += 1
+            return hit[0]
+        QUOTE_CACHE_STATS["misses"] += 1
+        gen = _QUOTE_CACHE_GEN[0]
+
+    result = quote_price(checkin, checkout, guests, coupon=coupon, today=today, room_type=room_type)
+
+    with _QUOTE_CACHE_LOCK:
+        # un'invalidazione durante il calcolo può aver reso il risultato vecchio: non salvarlo
+        if gen == _QUOTE_CACHE_GEN[0]:
+            if key not in _QUOTE_CACHE:
+                for o in range(checkin.toordinal(), checkout.toordinal()):
+                    _QUOTE_CACHE_BY_DAY[o].add(key)
+            _QUOTE_CACHE[key] = (result, time.monotonic())
+            _QUOTE_CACHE.move_to_end(key)
+            while len(_QUOTE_CACHE) > QUOTE_CACHE_SIZE:
+                old, _ = _QUOTE_CACHE.popitem(last=False)
+                _quote_cache_unindex(old)
+                QUOTE_CACHE_STATS["evictions"] += 1
+    return result
+
+def invalidate_quote_cache(checkin, checkout):
+    """Scarta i preventivi in cache che includono almeno una notte di [checkin, checkout)."""
+    with _QUOTE_CACHE_LOCK:
+        _QUOTE_CACHE_GEN[0] += 1
+        for o in range(checkin.toordinal(), checkout.toordinal()):
+            for key in _QUOTE_CACHE_BY_DAY.pop(o, ()):
+                if _QUOTE_CACHE.pop(key, None) is not None:
+                    _quote_cache_unindex(key)
+                    QUOTE_CACHE_STATS["invalidations"] += 1
+
+def clear_quote_cache():
+    with _QUOTE_CACHE_LOCK:
+        _QUOTE_CACHE_GEN[0] += 1
+        QUOTE_CACHE_STATS["invalidations"] += len(_QUOTE_CACHE)
+        _QUOTE_CACHE.clear()
+        _QUOTE_CACHE_BY_DAY.clear()
+
+def quote_cache_stats():
+    with _QUOTE_CACHE_LOCK:
+        return {**QUOTE_CACHE_STATS, "size": len(_QUOTE_CACHE), "max_size": QUOTE_CACHE_SIZE}
+
+# ---------------------------
+#  Coalescing richieste identiche (single-flight)
+# ---------------------------
+# Richieste identiche concorrenti nello stesso processo (thread gthread)
+# condividono un solo calcolo: il primo thread ("leader") calcola, gli altri
+# ("followers") attendono e ricevono lo stesso risultato.
+_INFLIGHT = {}  # key -> {"done": Event, "result": ..., "error": ...}
+_INFLIGHT_LOCK = threading.Lock()
+SINGLE_FLIGHT_STATS = {"leaders": 0, "followers": 0}
+
+def single_flight(key, fn):
+    """Esegue fn() una sola volta per key tra le chiamate concorrenti e ne condivide il risultato."""
+    with _INFLIGHT_LOCK:
+        call = _INFLIGHT.get(key)
+        leader = call is None
+        if leader:
+            call = _INFLIGHT[key] = {"done": threading.Event(), "result": None, "error": None}
+            SINGLE_FLIGHT_STATS["leaders"] += 1
+        else:
+            SINGLE_FLIGHT_STATS["followers"] += 1
+
+    if not leader:
+        call["done"].wait()
+        if call["error"] is not None:
+            raise call["error"]
+        return call["result"]
+
+    try:
+        call["result"] = fn()
+    except Exception as e:
+        call["error"] = e
+        raise
+    finally:
+        with _INFLIGHT_LOCK:
+            del _INFLIGHT[key]
+        call["done"].set()
+    return call["result"]
+
+def single_flight_stats():
+    with _INFLIGHT_LOCK:
+        return {**SINGLE_FLIGHT_STATS, "in_flight": len(_INFLIGHT)}
+
+reload_pricing_config()
+
+# ---------------------------
+#  Init DB (se disponibile)
+# ---------------------------
+def init_db():
+    if not engine:
+        return
+    with engine.begin() as conn:
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS bookings (
+            id SERIAL PRIMARY KEY,
+            booking_id VARCHAR(32) NOT NULL,
+            product_id VARCHAR(64) NOT NULL,
+            room_type VARCHAR(32) NOT NULL,
+            checkin DATE NOT NULL,
+            checkout DATE NOT NULL,
+            guests INTEGER NOT NULL,
+            total_price NUMERIC(10,2) NOT NULL,
+            customer_name TEXT NOT NULL,
+            customer_email TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT NOW()
+        );
+        """))
+        # stato per /cancel e /modify, veicolo assegnato (vehicle_id); booking_id resta senza UNIQUE perché le righe
+        # create quando era solo un timestamp possono ripetersi
+        conn.execute(text("""
+        ALTER TABLE bookings ADD COLUMN IF NOT EXISTS status VARCHAR(16) NOT NULL DEFAULT 'reserved';
+        ALTER TABLE bookings ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
+        ALTER TABLE bookings ADD COLUMN IF NOT EXISTS vehicle_id VARCHAR(32);
+        ALTER TABLE bookings ADD COLUMN IF NOT EXISTS coupon VARCHAR(32);
+        CREATE INDEX IF NOT EXISTS bookings_booking_id ON bookings (booking_id);
+        CREATE INDEX IF NOT EXISTS bookings_vehicle ON bookings (product_id, vehicle_id, checkin);
+        """))
+        # una riga per (prodotto, pool, giorno): la colonna room_type contiene il pool
+        # (tipologia o pool condiviso); inventory_reserve() riserva tutte le notti di
+        # un soggiorno o nessuna (eccezione SPE01 => la statement intera fallisce)
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS inventory (
+            product_id VARCHAR(64) NOT NULL,
+            room_type VARCHAR(32) NOT NULL,
+            day DATE NOT NULL,
+            booked INTEGER NOT NULL DEFAULT 0 CHECK (booked >= 0),
+            PRIMARY KEY (product_id, room_type, day)
+        );
+        """))
+        # hold: notti già riservate in inventory, liberate alla scadenza se non prenotate
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS holds (
+            hold_id VARCHAR(32) PRIMARY KEY,
+            product_id VARCHAR(64) NOT NULL,
+            room_type VARCHAR(32) NOT NULL,
+            checkin DATE NOT NULL,
+            checkout DATE NOT NULL,
+            guests INTEGER NOT NULL,
+            total_price NUMERIC(10,2) NOT NULL,
+            expires_at TIMESTAMP NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS holds_expires_at ON holds (expires_at);
+        ALTER TABLE holds ADD COLUMN IF NOT EXISTS coupon VARCHAR(32);
+        """))
+        # lista d'attesa: l'indice GiST sugli intervalli di date trova le richieste
+        # che toccano le notti liberate senza scorrere tutta la tabella
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS waitlist (
+            id BIGSERIAL PRIMARY KEY,
+            waitlist_id VARCHAR(32) NOT NULL UNIQUE,
+            product_id VARCHAR(64) NOT NULL,
+            room_type VARCHAR(32) NOT NULL,
+            checkin DATE NOT NULL,
+            checkout DATE NOT NULL,
+            guests INTEGER NOT NULL,
+            customer_name TEXT NOT NULL,
+            customer_email TEXT NOT NULL,
+            status VARCHAR(16) NOT NULL DEFAULT 'waiting',
+            hold_id VARCHAR(32),
+            created_at TIMESTAMP DEFAULT NOW(),
+            offered_at TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS waitlist_nights ON waitlist
+            USING gist (daterange(checkin, checkout)) WHERE status = 'waiting';
+        """))
+        # una chiamata riserva le notti in tutti i pool della tipologia (in ordine di
+        # nome, stesso ordine di lock per tutti) o fallisce con SPE01
+        conn.execute(text("""
+        DROP FUNCTION IF EXISTS inventory_reserve(TEXT, TEXT, DATE, DATE, INTEGER);
+        CREATE OR REPLACE FUNCTION inventory_reserve(
+            p_product TEXT, p_pools TEXT[], p_from DATE, p_to DATE, p_caps INTEGER[])
+        RETURNS TABLE (res_pool TEXT, res_day DATE, res_booked INTEGER) LANGUAGE plpgsql AS $$
+        DECLARE
+            i INTEGER;
+            n INTEGER;
+        BEGIN
+            FOR i IN SELECT u.o FROM unnest(p_pools) WITH ORDINALITY AS u(pool, o) ORDER BY u.pool LOOP
+                RETURN QUERY
+                INSERT INTO inventory AS inv (product_id, room_type, day, booked)
+                SELECT p_product, p_pools[i], d::date, 1
+                FROM generate_series(p_from, p_to - 1, interval '1 day') AS d
+                ORDER BY 3
+                ON CONFLICT (product_id, room_type, day)
+                DO UPDATE SET booked = inv.booked + 1 WHERE inv.booked < p_caps[i]
+                RETURNING inv.room_type::text, inv.day, inv.booked;
+                GET DIAGNOSTICS n = ROW_COUNT;
+                IF n <> p_to - p_from THEN
+                    RAISE EXCEPTION 'inventory_full' USING ERRCODE = 'SPE01';
+                END IF;
+            END LOOP;
+        END $$;
+        """))
+
+if engine:
+    from sqlalchemy import text  # import qui per sicurezza
+    init_db()
+
+# ---------------------------
+#  Inventario (capacità per pool e giorno)
+# ---------------------------
+# L'occupazione per pool e giorno sta in BOOKINGS (PoolInventory). Senza DB è la
+# fonte di verità; con DB fa fede la tabella inventory (room_type = nome del
+# pool) e BOOKINGS ne è la copia di lettura, ricaricata a blocchi di giorni più
+# vecchi di INVENTORY_CACHE_TTL; le scritture di questo processo la aggiornano subito.
+_INVENTORY_BLOCK = 64
+_INVENTORY_LOADED = {}  # blocco (ordinale // _INVENTORY_BLOCK) -> caricato_il (monotonic)
+
+def _pool_params(pools):
+    return dict(pools=list(pools), caps=[POOLS[p] for p in pools])
+
+def _apply_inventory_rows(rows):
+    """Copia nella cache locale le righe (pool, giorno, occupazione) restituite dal DB."""
+    for pool, day, booked in rows:
+        if pool in POOLS:
+            BOOKINGS[pool].assign(day.toordinal(), [booked])
+
+def _refresh_inventory(a, b):
+    """
+    Con DB, ricarica con una sola query (tutti i pool) i blocchi scaduti che
+    coprono [a, b), limitato al periodo prenotabile: fuori nessuno prenota e
+    la cache resta com'è (niente span arbitrari materializzati nel tree).
+    """
+    first, last = bookable_window()
+    a, b = max(a, first), min(b, last)
+    if not engine or b <= a:
+        return
+    now = time.monotonic()
+    stale = [blk for blk in range(a // _INVENTORY_BLOCK, (b - 1) // _INVENTORY_BLOCK + 1)
+             if now - _INVENTORY_LOADED.get(blk, float("-inf")) > INVENTORY_CACHE_TTL]
+    if not stale:
+        return
+    lo = max(min(stale) * _INVENTORY_BLOCK, 1)
+    hi = (max(stale) + 1) * _INVENTORY_BLOCK
+    with engine.begin() as conn:
+        rows = conn.execute(text("""
+            SELECT room_type, day, booked FROM inventory
+            WHERE product_id = :product_id AND room_type = ANY(:pools) AND day >= :lo AND day < :hi
+        """), dict(product_id=PRODUCT["id"], pools=POOL_NAMES,
+                   lo=date.fromordinal(lo), hi=date.fromordinal(hi))).all()
+    values = {p: [0] * (hi - lo) for p in POOL_NAMES}
+    for pool, day, booked in rows:
+        values[pool][day.toordinal() - lo] = booked
+    with BOOKINGS.lock:
+        for pool, v in values.items():
+            BOOKINGS[pool].assign(lo, v)
+    for blk in range(min(stale), max(stale) + 1):
+        _INVENTORY_LOADED[blk] = now
+
+def inventory_counts(pool, start, end):
+    """Occupazione del pool in ogni giorno di [start, end), come lista di int."""
+    a, b = start.toordinal(), end.toordinal()
+    _refresh_inventory(a, b)
+    return BOOKINGS[pool].counts(a, b)
+
+def inventory_count(pool, d):
+    return inventory_counts(pool, d, d + timedelta(days=1))[0]
+
+def inventory_max(pool, start, end):
+    """Occupazione massima del pool sulle notti [start, end): O(log n) sul segment tree."""
+    a, b = start.toordinal(), end.toordinal()
+    _refresh_inventory(a, b)
+    return BOOKINGS[pool].range_max(a, b)
+
+def inventory_free(start, end):
+    """
+    Posti liberi per tipologia (righe in ordine ROOM_TYPES) e giorno di [start, end):
+    per ogni tipologia il minimo sui suoi pool, con una sola operazione sulla
+    matrice pool x giorni.
+    """
+    a, b = start.toordinal(), end.toordinal()
+    _refresh_inventory(a, b)
+    free = POOL_CAPS[:, None] - BOOKINGS.matrix(a, b)
+    return np.where(ROOM_POOL_MASK[:, :, None], free[None], np.iinfo(np.int64).max).min(axis=1)
+
+def first_full_day(room_type, start, end):
+    """Prima notte di [start, end) senza posti in uno dei pool della tipologia, o None."""
+    first = None
+    for pool in ROOM_POOLS[room_type]:
+        # il massimo sul segment tree esclude quasi sempre la scansione per giorno
+        if inventory_max(pool, start, first or end) >= POOLS[pool]:
+            for i, booked in enumerate(inventory_counts(pool, start, first or end)):
+                if booked >= POOLS[pool]:
+                    first = start + timedelta(days=i)
+                    break
+    return first
+
+def inventory_full_days(lo, hi):
+    """Per ogni tipologia (ordine ROOM_TYPES), ordinali crescenti dei giorni in [lo, hi) senza posti."""
+    _refresh_inventory(lo, hi)
+    full = {}
+    for pool in POOL_NAMES:
+        inv = BOOKINGS[pool]
+        base, end = inv.domain()
+        a, b = max(lo, base), min(hi, end)
+        full[pool] = np.zeros(0, dtype=np.int64)
+        if a < b and inv.range_max(a, b) >= POOLS[pool]:
+            full[pool] = np.flatnonzero(np.array(inv.counts(a, b)) >= POOLS[pool]) + a
+    empty = np.zeros(0, dtype=np.int64)
+    return [np.unique(np.concatenate([full[p] for p in ROOM_POOLS[rt]] + [empty]))
+            for rt in ROOM_TYPES]
+
+_RESERVE_SQL = """
+    WITH reserved AS (
+        SELECT res_pool, res_day, res_booked
+        FROM inventory_reserve(:product_id, CAST(:pools AS text[]), CAST(:checkin AS date),
+                               CAST(:checkout AS date), CAST(:caps AS int[]))
+    ){booking_cte}
+    SELECT res_pool, res_day, res_booked FROM reserved
+"""
+_RESERVE_BOOKING_CTE = """, saved AS (
+        INSERT INTO bookings
+        (booking_id, product_id, room_type, checkin, checkout, guests, total_price, customer_name, customer_email,
+         coupon)
+        SELECT :booking_id, :product_id, :room_type, CAST(:checkin AS date), CAST(:checkout AS date),
+               :guests, :total_price, :customer_name, :customer_email, :coupon
+        WHERE EXISTS (SELECT 1 FROM reserved)
+        RETURNING id
+    )"""
+_RESERVE_HOLD_CTE = """, saved AS (
+        INSERT INTO holds
+        (hold_id, product_id, room_type, checkin, checkout, guests, total_price, expires_at, coupon)
+        SELECT :hold_id, :product_id, :room_type, CAST(:checkin AS date), CAST(:checkout AS date),
+               :guests, :total_price, :expires_at, :coupon
+        WHERE EXISTS (SELECT 1 FROM reserved)
+        RETURNING hold_id
+    )"""
+
+def _db_reserve(checkin, checkout, pools, booking, hold):
+    params = dict(product_id=PRODUCT["id"], checkin=checkin, checkout=checkout,
+                  **_pool_params(pools), **(booking or hold or {}))
+    cte = _RESERVE_BOOKING_CTE if booking else _RESERVE_HOLD_CTE if hold else ""
+    sql = _RESERVE_SQL.format(booking_cte=cte)
+    try:
+        # un'unica statement in autocommit: un round trip, atomica per costruzione
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            rows = conn.execute(text(sql), params).all()
+    except DBAPIError as e:
+        if getattr(e.orig, "pgcode", None) == "SPE01":
+            return False
+        raise
+    _apply_inventory_rows(rows)
+    return True
+
+def _reserve_memory(ranges):
+    """Senza DB: ranges = [(pool, a, b)], tutti o nessuno. Va chiamata tenendo BOOKINGS.lock."""
+    if any(BOOKINGS[p].range_max(a, b) >= POOLS[p] for p, a, b in ranges):
+        return False
+    for p, a, b in ranges:
+        BOOKINGS[p].range_add(a, b, 1)
+    return True
+
+def reserve_nights(checkin, checkout, room_type, booking=None, hold=None):
+    """
+    Occupa un posto per ogni notte di [checkin, checkout) in ogni pool della
+    tipologia: tutte o nessuna, in modo atomico rispetto alle prenotazioni
+    concorrenti. Ritorna False se almeno una notte è piena. Con DB, se booking
+    (parametri della riga bookings) o hold (riga holds) è dato viene salvato
+    nella stessa statement.
+    """
+    pools = ROOM_POOLS[room_type]
+    if engine:
+        ok = _db_reserve(checkin, checkout, pools, booking, hold)
+    else:
+        # controllo e incremento sotto il lock comune dei pool: O(log n) ciascuno
+        a, b = checkin.toordinal(), checkout.toordinal()
+        with BOOKINGS.lock:
+            ok = _reserve_memory([(p, a, b) for p in pools])
+    if ok:
+        invalidate_quote_cache(checkin, checkout)
+    return ok
+
+# Warm start: all'avvio, prima di servire traffico. Le notti prenotate vengono
+# espanse in SQL (generate_series), mappate sui pool della tipologia e aggregate
+# per pool e giorno senza passare dal processo; le righe di inventory arrivano
+# con un cursore lato server.
+_WARM_REPAIR_SQL = """
+    WITH room_pools AS (
+        SELECT * FROM unnest(CAST(:map_rt AS text[]), CAST(:map_pool AS text[])) AS m(room_type, pool)
+    ), nights AS (
+        SELECT m.pool, d::date AS day, COUNT(*)::int AS booked
+        FROM bookings b
+        JOIN room_pools m ON m.room_type = b.room_type
+        CROSS JOIN LATERAL generate_series(b.checkin, b.checkout - 1, interval '1 day') AS d
+        WHERE b.product_id = :product_id AND b.status <> 'cancelled' AND b.checkout > :since AND d >= :since
+        GROUP BY 1, 2
+    ), repaired AS (
+        INSERT INTO inventory AS inv (product_id, room_type, day, booked)
+        SELECT :product_id, pool, day, booked FROM nights
+        ON CONFLICT (product_id, room_type, day)
+        DO UPDATE SET booked = EXCLUDED.booked WHERE inv.booked < EXCLUDED.booked
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM bookings
+            WHERE product_id = :product_id AND status <> 'cancelled' AND checkout > :since),
+           (SELECT COUNT(*) FROM repaired)
+"""
+WARM_START_STATS = {"bookings": 0, "repaired_days": 0, "rows": 0, "seconds": 0.0, "rows_per_s": 0.0}
+
+def _room_pool_map():
+    pairs = [(rt, p) for rt, pools in ROOM_POOLS.items() for p in pools]
+    return dict(map_rt=[rt for rt, _ in pairs], map_pool=[p for _, p in pairs])
+
+def warm_start_inventory(today=None, chunk=5000):
+    """
+    Con DB: riallinea inventory alle righe di bookings (mai verso il basso, così
+    una prenotazione concorrente non va persa) e carica in BOOKINGS l'occupazione
+    da oggi in poi. Ritorna WARM_START_STATS.
+    """
+    if not engine:
+        return WARM_START_STATS
+    today = today or datetime.utcnow().date()
+    params = dict(product_id=PRODUCT["id"], pools=POOL_NAMES, since=today,
+                  until=date.fromordinal(bookable_window()[1]), **_room_pool_map())
+    t0 = time.perf_counter()
+    with engine.begin() as conn:
+        n_bookings, n_repaired = conn.execute(text(_WARM_REPAIR_SQL), params).one()
+    rows, lo = 0, today.toordinal()
+    cursor = dict.fromkeys(POOL_NAMES, lo)
+    with engine.connect().execution_options(stream_results=True, yield_per=chunk) as conn:
+        result = conn.execute(text("""
+            SELECT room_type, day, booked FROM inventory
+            WHERE product_id = :product_id AND room_type = ANY(:pools) AND day >= :since AND day < :until
+            ORDER BY room_type, day
+        """), params)
+        for part in result.partitions():
+            # un assign per pool e blocco di righe; i giorni senza riga valgono 0
+            by_pool = defaultdict(list)
+            for pool, day, booked in part:
+                by_pool[pool].append((day.toordinal(), booked))
+            for pool, items in by_pool.items():
+                start, end = cursor[pool], items[-1][0] + 1
+                values = [0] * (end - start)
+                for o, booked in items:
+                    values[o - start] = booked
+                BOOKINGS[pool].assign(start, values)
+                cursor[pool] = end
+            rows += len(part)
+    now = time.monotonic()
+    for blk in range(lo // _INVENTORY_BLOCK + 1, min(cursor.values()) // _INVENTORY_BLOCK):
+        _INVENTORY_LOADED[blk] = now
+    clear_quote_cache()
+    elapsed = time.perf_counter() - t0
+    WARM_START_STATS.update(bookings=n_bookings, repaired_days=n_repaired, rows=rows,
+                            seconds=round(elapsed, 4),
+                            rows_per_s=round((n_bookings + rows) / elapsed) if elapsed else 0.0)
+    app.logger.info(f"Warm start inventario: {n_bookings} prenotazioni, {n_repaired} giorni "
+                    f"riallineati, {rows} giorni caricati in {elapsed * 1000:.1f} ms "
+                    f"({WARM_START_STATS['rows_per_s']} righe/s)")
+    return WARM_START_STATS
+
+# righe bloccate in ordine (pool, giorno), lo stesso di inventory_reserve(): chi
+# riserva e chi libera le stesse notti non si bloccano a vicenda (deadlock 40P01)
+_RELEASE_SQL = """
+    WITH locked AS (
+        SELECT room_type, day FROM inventory
+        WHERE product_id = :product_id AND room_type = ANY(:pools) AND day >= :checkin AND day < :checkout
+        ORDER BY room_type, day
+        FOR UPDATE
+    )
+    UPDATE inventory AS inv SET booked = inv.booked - 1
+    FROM locked
+    WHERE inv.product_id = :product_id AND inv.room_type = locked.room_type AND inv.day = locked.day
+    RETURNING inv.room_type, inv.day, inv.booked
+"""
+
+def release_nights(checkin, checkout, room_type):
+    """Libera un posto per ogni notte di [checkin, checkout) nei pool della tipologia (inverso di reserve_nights)."""
+    pools = ROOM_POOLS[room_type]
+    if engine:
+        with engine.begin() as conn:
+            rows = conn.execute(text(_RELEASE_SQL), dict(product_id=PRODUCT["id"], pools=pools,
+                                                         checkin=checkin, checkout=checkout)).all()
+        _apply_inventory_rows(rows)
+    else:
+        with BOOKINGS.lock:
+            for pool in pools:
+                BOOKINGS[pool].range_add(checkin.toordinal(), checkout.toordinal(), -1)
+    invalidate_quote_cache(checkin, checkout)
+
+if engine:
+    warm_start_inventory()
+
+# ---------------------------
+#  Hold (blocchi temporanei durante il checkout)
+# ---------------------------
+# Un hold riserva le notti con reserve_nights() come una prenotazione e scade
+# dopo HOLD_TTL_MINUTES se non diventa prenotazione (/book con hold_id).
+# Scadenze: min-heap (scadenza, hold_id) svuotato da un thread che dorme fino
+# alla prima scadenza; dopo ogni giro attende HOLD_REAP_INTERVAL, così gli hold
+# che scadono a breve distanza escono in un solo batch. Lo heap ha al massimo
+# HOLDS_MAX voci (anche quelle già prenotate, rimosse solo alla scadenza): oltre
+# si rifiutano nuovi hold. Senza DB gli hold stanno in HOLDS (per processo);
+# con DB nella tabella holds, e il batch libera tutti gli hold scaduti del
+# prodotto, anche quelli creati da worker nel frattempo terminati: per questo
+# con DB il thread gira in ogni worker (avviato alla prima richiesta) e almeno
+# ogni HOLD_SWEEP_INTERVAL. Con l'inventario in shared memory gli hold non ci
+# sono: le notti starebbero nel segmento comune ma l'hold solo nel worker che
+# l'ha creato, e un worker riciclato le lascerebbe occupate per sempre.
+HOLDS_ENABLED = bool(engine or not INVENTORY_SHM_NAME)
+HOLDS = {}        # hold_id -> dict(checkin, checkout, room_type, guests, total_price, expires_at) (solo senza DB)
+_HOLD_HEAP = []   # (scadenza epoch, hold_id)
+_HOLDS_LOCK = threading.Condition()
+_HOLD_REAPER = [None]
+HOLD_STATS = {"created": 0, "booked": 0, "expired": 0, "rejected": 0, "batches": 0}
+
+_EXPIRE_HOLDS_SQL = """
+    WITH expired AS (
+        DELETE FROM holds WHERE product_id = :product_id AND {which}
+        RETURNING room_type, checkin, checkout
+    ), room_pools AS (
+        SELECT * FROM unnest(CAST(:map_rt AS text[]), CAST(:map_pool AS text[])) AS m(room_type, pool)
+    ), nights AS (
+        SELECT m.pool, d::date AS day, COUNT(*)::int AS n
+        FROM expired e
+        JOIN room_pools m ON m.room_type = e.room_type
+        CROSS JOIN LATERAL generate_series(e.checkin, e.checkout - 1, interval '1 day') AS d
+        GROUP BY 1, 2
+    ), locked AS (
+        -- stesso ordine di blocco di inventory_reserve() e _RELEASE_SQL
+        SELECT inv.room_type, inv.day FROM inventory AS inv
+        JOIN nights ON inv.room_type = nights.pool AND inv.day = nights.day
+        WHERE inv.product_id = :product_id
+        ORDER BY inv.room_type, inv.day
+        FOR UPDATE OF inv
+    )
+    UPDATE inventory AS inv SET booked = inv.booked - nights.n
+    FROM nights JOIN locked ON locked.room_type = nights.pool AND locked.day = nights.day
+    WHERE inv.product_id = :product_id AND inv.room_type = nights.pool AND inv.day = nights.day
+    RETURNING inv.room_type, inv.day, inv.booked, (SELECT COUNT(*) FROM expired)
+"""
+_BOOK_HOLD_SQL = """
+    WITH held AS (
+        DELETE FROM holds WHERE hold_id = :hold_id AND product_id = :product_id AND expires_at > :now
+        RETURNING room_type, checkin, checkout, guests, total_price, coupon
+    )
+    INSERT INTO bookings
+    (booking_id, product_id, room_type, checkin, checkout, guests, total_price, customer_name, customer_email, coupon)
+    SELECT :booking_id, :product_id, room_type, checkin, checkout, guests, total_price,
+           :customer_name, :customer_email, coupon
+    FROM held
+    RETURNING room_type, checkin, checkout, guests, total_price, coupon
+"""
+
+def create_hold(checkin, checkout, guests, room_type, total_price, minutes=None, coupon=None):
+    """
+    Riserva le notti per 'minutes' (default e massimo HOLD_TTL_MINUTES); il
+    coupon del prezzo passa alla prenotazione.
+    Ritorna il dict dell'hold, None se troppi hold in corso, False se capacità esaurita.
+    """
+    if not HOLDS_ENABLED:
+        raise RuntimeError("Hold non disponibili con l'inventario in shared memory")
+    minutes = HOLD_TTL_MINUTES if minutes is None else minutes
+    if not (math.isfinite(minutes) and minutes > 0):
+        raise ValueError(f"Durata hold non valida: {minutes}")
+    minutes = min(minutes, HOLD_TTL_MINUTES)
+    with _HOLDS_LOCK:
+        if len(_HOLD_HEAP) >= HOLDS_MAX:
+            HOLD_STATS["rejected"] += 1
+            return None
+    expires = time.time() + minutes * 60
+    hold = dict(hold_id=f"HD-{secrets.token_hex(8)}", room_type=room_type, guests=guests,
+                total_price=total_price, checkin=checkin, checkout=checkout,
+                expires_at=datetime.utcfromtimestamp(expires), coupon=coupon)
+    row = {k: v for k, v in hold.items() if k not in ("checkin", "checkout")}
+    if not reserve_nights(checkin, checkout, room_type, hold=row if engine else None):
+        return False
+    with _HOLDS_LOCK:
+        if not engine:
+            HOLDS[hold["hold_id"]] = hold
+        heapq.heappush(_HOLD_HEAP, (expires, hold["hold_id"]))
+        HOLD_STATS["created"] += 1
+        _HOLDS_LOCK.notify()
+    ensure_hold_reaper()
+    return hold
+
+def ensure_hold_reaper():
+    """Avvia il thread delle scadenze in questo processo se non gira (i thread non sopravvivono al fork di --preload)."""
+    with _HOLDS_LOCK:
+        if not (_HOLD_REAPER[0] and _HOLD_REAPER[0].is_alive()):
+            _HOLD_REAPER[0] = threading.Thread(target=_hold_reaper, name="hold-reaper", daemon=True)
+            _HOLD_REAPER[0].start()
+
+def book_hold(hold_id, booking_id, customer):
+    """
+    Trasforma l'hold in prenotazione: le notti restano riservate. Con DB cancella
+    l'hold e inserisce la riga bookings in una statement. Ritorna il dict
+    dell'hold, o None se inesistente o scaduto.
+    """
+    if engine:
+        with engine.begin() as conn:
+            row = conn.execute(text(_BOOK_HOLD_SQL), dict(
+                hold_id=hold_id, product_id=PRODUCT["id"], now=datetime.utcnow(), booking_id=booking_id,
+                customer_name=customer.get("name", ""), customer_email=customer.get("email", ""))).mappings().first()
+        hold = dict(row, total_price=float(row["total_price"])) if row else None
+    else:
+        with _HOLDS_LOCK:
+            hold = HOLDS.get(hold_id)
+            if hold and hold["expires_at"] > datetime.utcnow():
+                del HOLDS[hold_id]
+            else:
+                hold = None
+        if hold:
+            _waitlist_hold_closed([hold_id])
+    if hold:
+        HOLD_STATS["booked"] += 1
+    return hold
+
+def _db_drop_holds(which, **params):
+    """
+    Con DB: cancella gli hold del prodotto che soddisfano la condizione SQL
+    `which` e ne libera le notti. Ritorna (giorni liberati, hold cancellati).
+    """
+    with engine.begin() as conn:
+        rows = conn.execute(text(_EXPIRE_HOLDS_SQL.format(which=which)), dict(
+            product_id=PRODUCT["id"], **params, **_room_pool_map())).all()
+    _apply_inventory_rows([r[:3] for r in rows])
+    released = sorted({day for _, day, _, _ in rows})
+    for day in released:
+        invalidate_quote_cache(day, day + timedelta(days=1))
+    return released, rows[0][3] if rows else 0
+
+def expire_holds(hold_ids=(), now=None):
+    """
+    Libera in un batch le notti degli hold scaduti: senza DB quelli in hold_ids
+    (estratti dallo heap), con DB tutti quelli scaduti del prodotto.
+    Ritorna i giorni liberati (date).
+    """
+    now = now or datetime.utcnow()
+    released = []
+    if engine:
+        released, expired = _db_drop_holds("expires_at <= :now", now=now)
+    else:
+        with _HOLDS_LOCK:
+            due = [HOLDS.pop(i) for i in hold_ids if i in HOLDS and HOLDS[i]["expires_at"] <= now]
+        _waitlist_hold_closed([h["hold_id"] for h in due])
+        with BOOKINGS.lock:
+            for h in due:
+                release_nights(h["checkin"], h["checkout"], h["room_type"])
+        released = sorted({d for h in due for d in daterange(h["checkin"], h["checkout"])})
+        expired = len(due)
+    HOLD_STATS["expired"] += expired
+    HOLD_STATS["batches"] += 1
+    return released
+
+def _hold_reaper():
+    while True:
+        with _HOLDS_LOCK:
+            # con DB un giro anche senza scadenze locali: hold di altri worker o di un avvio precedente
+            sweep = time.time() + HOLD_SWEEP_INTERVAL if engine else float("inf")
+            while not _HOLD_HEAP or _HOLD_HEAP[0][0] > time.time():
+                wake = min(_HOLD_HEAP[0][0] if _HOLD_HEAP else float("inf"), sweep)
+                if wake <= time.time():
+                    break
+                _HOLDS_LOCK.wait(wake - time.time() if wake < float("inf") else None)
+            now = time.time()
+            due = []
+            while _HOLD_HEAP and _HOLD_HEAP[0][0] <= now:
+                due.append(heapq.heappop(_HOLD_HEAP)[1])
+        try:
+            released = expire_holds(due, datetime.utcfromtimestamp(now))
+        except Exception as e:
+            app.logger.warning(f"Scadenza hold fallita: {e}")
+            released = []
+        notify_released(day_ranges(released))
+        time.sleep(HOLD_REAP_INTERVAL)
+
+def hold_stats():
+    with _HOLDS_LOCK:
+        return {**HOLD_STATS, "scheduled": len(_HOLD_HEAP), "active": len(HOLDS) if not engine else None}
+
+if engine:
+    expire_holds()  # hold rimasti da un'esecuzione precedente
+
+    @app.before_request
+    def _hold_reaper_alive():
+        # non all'import: con --preload il thread resterebbe al master, non ai worker
+        ensure_hold_reaper()
+
+# ---------------------------
+#  Prenotazioni: cancellazione e modifica
+# ---------------------------
+# Con DB fa fede la riga bookings (status 'reserved' / 'cancelled'); senza DB le
+# prenotazioni di questo processo stanno in BOOKING_RECORDS. Una modifica tocca
+# solo le notti che cambiano (nights_diff), pool per pool: se cambia la tipologia
+# i pool condivisi (auto) restano occupati sulle notti comuni. Riserva le nuove e
+# libera quelle lasciate nella stessa transazione, o sotto il lock dell'inventario senza DB,
+# così il soggiorno non occupa mai entrambe le date né nessuna delle due.
+# Con l'inventario in shared memory senza DB /cancel e /modify non ci sono:
+# BOOKING_RECORDS è del worker che ha preso la prenotazione e gli altri
+# risponderebbero 404.
+BOOKING_CHANGES_ENABLED = bool(engine or not INVENTORY_SHM_NAME)
+BOOKING_RECORDS = {}  # booking_id -> dict(room_type, checkin, checkout, guests, total_price, coupon, customer_email, status)
+
+_FIND_BOOKING_SQL = """
+    SELECT id, room_type, checkin, checkout, guests, total_price, coupon, customer_email
+    FROM bookings
+    WHERE booking_id = :booking_id AND product_id = :product_id AND status <> 'cancelled'
+      AND lower(customer_email) = lower(:email)
+    ORDER BY id LIMIT 1
+    FOR UPDATE
+"""
+
+def new_booking_id():
+    """Timestamp come prima più un suffisso casuale: unico anche per prenotazioni nello stesso secondo."""
+    return f"BK-{int(datetime.utcnow().timestamp())}-{secrets.token_hex(4)}"
+
+def remember_booking(booking_id, room_type, checkin, checkout, guests, total_price, customer, coupon=None):
+    """Senza DB tiene la prenotazione per /cancel e /modify (con DB c'è la riga bookings)."""
+    if not engine:
+        BOOKING_RECORDS[booking_id] = dict(room_type=room_type, checkin=checkin, checkout=checkout,
+                                           guests=guests, total_price=total_price, coupon=coupon,
+                                           customer_email=customer.get("email", ""), status="reserved")
+
+def nights_diff(a, b, c, d):
+    """Intervalli di notti (ordinali) di [a, b) che non sono in [c, d): al più due."""
+    if d <= a or b <= c:
+        return [(a, b)] if a < b else []
+    return [(x, y) for x, y in ((a, c), (d, b)) if x < y]
+
+def _find_booking(booking_id, email):
+    rec = BOOKING_RECORDS.get(booking_id)
+    if not rec or rec["status"] == "cancelled" or rec["customer_email"].lower() != (email or "").lower():
+        return None
+    return rec
+
+def cancel_booking(booking_id, email):
+    """
+    Cancella la prenotazione (serve l'email del cliente) e libera le sue notti.
+    Ritorna (ok, msg, prenotazione); prenotazione None se non trovata.
+    """
+    if engine:
+        with engine.begin() as conn:
+            row = conn.execute(text(_FIND_BOOKING_SQL), dict(
+                booking_id=booking_id, product_id=PRODUCT["id"], email=email)).mappings().first()
+            if not row:
+                return (False, "Prenotazione non trovata", None)
+            conn.execute(text("UPDATE bookings SET status = 'cancelled', updated_at = NOW() WHERE id = :id"),
+                         dict(id=row["id"]))
+            rows = conn.execute(text(_RELEASE_SQL), dict(
+                product_id=PRODUCT["id"], pools=ROOM_POOLS.get(row["room_type"], []),
+                checkin=row["checkin"], checkout=row["checkout"])).all()
+        _apply_inventory_rows(rows)
+        booking = dict(row, status="cancelled")
+    else:
+        with BOOKINGS.lock:
+            rec = _find_booking(booking_id, email)
+            if not rec:
+                return (False, "Prenotazione non trovata", None)
+            rec["status"] = "cancelled"
+            release_nights(rec["checkin"], rec["checkout"], rec["room_type"])
+        booking = dict(rec)
+    invalidate_quote_cache(booking["checkin"], booking["checkout"])
+    return (True, "ok", booking)
+
+def _modify_error(room_type, guests, checkin, checkout):
+    """Controlli di quote_price() sul nuovo soggiorno, esclusa la capacità (si verifica solo sulle notti aggiunte)."""
+    if room_type not in ROOM_TYPES:
+        return f"Tipologia camera non valida: {room_type}"
+    if guests < 1 or guests > ROOM_TYPES[room_type]["max_guests"]:
+        return f"Ospiti non validi per {room_type} (max {ROOM_TYPES[room_type]['max_guests']})"
+    err = _stay_window_error(checkin, checkout)
+    if err:
+        return err[1]
+    blackout = first_blackout(checkin, checkout)
+    if blackout:
+        return f"Data non disponibile: {blackout}"
+    return None
+
+def modify_booking(booking_id, email, checkin, checkout, *, guests=None, room_type=None, coupon=None, today=None):
+    """
+    Sposta la prenotazione su [checkin, checkout) (ed eventualmente cambia ospiti,
+    tipologia o coupon) al prezzo attuale del nuovo soggiorno, con il coupon
+    della prenotazione se 'coupon' non lo sostituisce. Se soggiorno e coupon non
+    cambiano il prezzo resta quello pagato. Ritorna (ok, msg, prenotazione
+    aggiornata); prenotazione None se non trovata.
+    """
+    def _apply(old):
+        rt = (room_type or old["room_type"]).lower()
+        g = old["guests"] if guests is None else int(guests)
+        err = _modify_error(rt, g, checkin, checkout)
+        if err:
+            return err, None
+        cp = applied_coupon(coupon) if coupon is not None else old.get("coupon")
+        same = ((rt, g, checkin, checkout, cp) ==
+                (old["room_type"], old["guests"], old["checkin"], old["checkout"], old.get("coupon")))
+        price = float(old["total_price"]) if same else stay_price(rt, checkin, checkout, g, today=today, coupon=cp)
+        added, removed = [], []
+        for pool in POOL_NAMES:
+            # notti del pool prima e dopo; (0, 0) se la tipologia non usa il pool
+            o_in, o_out = ((old["checkin"].toordinal(), old["checkout"].toordinal())
+                           if pool in ROOM_POOLS.get(old["room_type"], ()) else (0, 0))
+            n_in, n_out = (checkin.toordinal(), checkout.toordinal()) if pool in ROOM_POOLS[rt] else (0, 0)
+            added += [(pool, a, b) for a, b in nights_diff(n_in, n_out, o_in, o_out)]
+            removed += [(pool, a, b) for a, b in nights_diff(o_in, o_out, n_in, n_out)]
+        return None, dict(room_type=rt, guests=g, total_price=price, coupon=cp, added=added, removed=removed)
+
+    full = "Capacità esaurita per le date richieste"
+    if engine:
+        params = dict(product_id=PRODUCT["id"])
+        try:
+            with engine.begin() as conn:
+                row = conn.execute(text(_FIND_BOOKING_SQL), dict(
+                    booking_id=booking_id, product_id=PRODUCT["id"], email=email)).mappings().first()
+                if not row:
+                    return (False, "Prenotazione non trovata", None)
+                err, change = _apply(row)
+                if err:
+                    return (False, err, dict(row))
+                counts = []
+                # righe toccate in ordine (pool, giorno) come inventory_reserve(): niente deadlock con /book
+                ops = sorted([(pool, a, b, True) for pool, a, b in change["added"]] +
+                             [(pool, a, b, False) for pool, a, b in change["removed"]])
+                for pool, a, b, add in ops:
+                    nights = dict(params, checkin=date.fromordinal(a), checkout=date.fromordinal(b))
+                    if add:
+                        # SPE01 se una notte è piena: rollback dell'intera modifica
+                        counts += conn.execute(text("""
+                            SELECT res_pool, res_day, res_booked
+                            FROM inventory_reserve(:product_id, CAST(:pools AS text[]), CAST(:checkin AS date),
+                                                   CAST(:checkout AS date), CAST(:caps AS int[]))
+                        """), dict(nights, **_pool_params([pool]))).all()
+                    else:
+                        counts += conn.execute(text(_RELEASE_SQL), dict(nights, pools=[pool])).all()
+                conn.execute(text("""
+                    UPDATE bookings
+                    SET checkin = :checkin, checkout = :checkout, guests = :guests, room_type = :room_type,
+                        total_price = :total_price, coupon = :coupon, updated_at = NOW()
+                    WHERE id = :id
+                """), dict(id=row["id"], checkin=checkin, checkout=checkout, guests=change["guests"],
+                           room_type=change["room_type"], total_price=change["total_price"],
+                           coupon=change["coupon"]))
+        except DBAPIError as e:
+            if getattr(e.orig, "pgcode", None) == "SPE01":
+                return (False, full, dict(row))
+            raise
+        _apply_inventory_rows(counts)
+        old = dict(row)
+    else:
+        with BOOKINGS.lock:
+            rec = _find_booking(booking_id, email)
+            if not rec:
+                return (False, "Prenotazione non trovata", None)
+            err, change = _apply(rec)
+            if err:
+                return (False, err, dict(rec))
+            if not _reserve_memory(change["added"]):
+                return (False, full, dict(rec))
+            for pool, a, b in change["removed"]:
+                BOOKINGS[pool].range_add(a, b, -1)
+            old = dict(rec)
+            rec.update(checkin=checkin, checkout=checkout, guests=change["guests"],
+                       room_type=change["room_type"], total_price=change["total_price"],
+                       coupon=change["coupon"])
+    for _, a, b in change["added"] + change["removed"]:
+        invalidate_quote_cache(date.fromordinal(a), date.fromordinal(b))
+    booking = dict(old, checkin=checkin, checkout=checkout, guests=change["guests"],
+                   room_type=change["room_type"], total_price=change["total_price"], coupon=change["coupon"])
+    booking["previous"] = {"checkin": old["checkin"], "checkout": old["checkout"],
+                           "room_type": old["room_type"], "total_price": float(old["total_price"])}
+    return (True, "ok", booking)
+
+# ---------------------------
+#  Flotta auto (assegnazione veicoli)
+# ---------------------------
+# Il pool "auto" garantisce che in nessun giorno le auto prenotate superino la
+# flotta; qui ogni prenotazione riceve un veicolo preciso. Online: best fit,
+# il veicolo (della categoria preferita se possibile) che lascia i buchi più
+# corti prima e dopo il noleggio. Se nessun veicolo ha l'intervallo libero pur
+# essendoci capacità (frammentazione), e dopo ogni cancellazione, si
+# riassegna tutto con pack_rentals(). I noleggi già iniziati non cambiano
+# veicolo. Senza DB le assegnazioni stanno in CAR_FLEET (per processo); con DB
+# nella colonna bookings.vehicle_id: il best fit legge solo i noleggi vicini
+# dei veicoli e occupa il veicolo scelto sotto il suo advisory lock (condiviso
+# con gli altri veicoli), la riassegnazione completa prende il lock esclusivo
+# del prodotto e serve solo in caso di frammentazione. Con DB la cancellazione
+# libera il veicolo da sola (status 'cancelled') e non ricompatta.
+FLEET_CATEGORIES = {v["id"]: v["category"] for v in FLEET}
+
+def pack_rentals(fleet, rentals, today=0):
+    """
+    Assegnazione offline dei noleggi ai veicoli. rentals = [(inizio, fine,
+    booking_id, categoria, veicolo attuale)] con [inizio, fine) in ordinali.
+    In ordine di inizio (a parità, prima chi finisce prima) ogni noleggio va su
+    un veicolo libero: della sua categoria se possibile, poi il veicolo attuale,
+    poi uno su cui non si sovrappone ai noleggi già assegnati, infine quello
+    liberato più di recente (buco minimo). Così non servono mai più veicoli del
+    massimo di noleggi sovrapposti e si sposta solo chi deve. I noleggi
+    iniziati entro 'today' restano sul veicolo attuale.
+    Ritorna {booking_id: veicolo}, o None se a un inizio nessun veicolo è libero.
+    """
+    free_at = dict.fromkeys(fleet, 0)
+    planned = defaultdict(list)   # veicolo -> inizi ordinati dei noleggi assegnati oggi
+    for a, _, _, _, current in rentals:
+        if current in fleet:
+            planned[current].append(a)
+    for starts in planned.values():
+        starts.sort()
+
+    def _clashes(vid, a, b):
+        starts = planned[vid]
+        i = bisect.bisect_right(starts, a)
+        return i < len(starts) and starts[i] < b
+
+    plan = {}
+    order = sorted(rentals, key=lambda r: (r[0], not (r[0] <= today and r[4] in fleet), r[1]))
+    for a, b, booking_id, category, current in order:
+        if a <= today and current in fleet and free_at[current] <= a:
+            vid = current
+        else:
+            vids = [v for v, t in free_at.items() if t <= a]
+            if not vids:
+                return None
+            vid = min(vids, key=lambda v: (fleet[v] != category, v != current,
+                                           _clashes(v, a, b), a - free_at[v]))
+        free_at[vid] = b
+        plan[booking_id] = vid
+    return plan
+
+class FleetAllocator:
+    """
+    Noleggi assegnati alla flotta: per veicolo la lista (inizio, fine,
+    booking_id) ordinata per inizio; assigned: booking_id -> (veicolo, inizio,
+    fine, categoria). Le operazioni ritornano {booking_id: nuovo veicolo} delle
+    prenotazioni assegnate o spostate.
+    """
+
+    def __init__(self, fleet=FLEET_CATEGORIES):
+        self.fleet = dict(fleet)
+        self.rentals = {vid: [] for vid in self.fleet}
+        self.assigned = {}
+        self.lock = threading.RLock()
+        self.stats = {"allocated": 0, "repacks": 0, "moved": 0, "failed": 0}
+
+    def _gaps(self, vid, a, b, horizon=366):
+        """Giorni liberi lasciati prima e dopo [a, b) sul veicolo (horizon se non c'è un noleggio vicino), o None se occupato."""
+        items = self.rentals[vid]
+        i = bisect.bisect_left(items, (a,))
+        before = a - items[i - 1][1] if i else horizon
+        after = items[i][0] - b if i < len(items) else horizon
+        return None if before < 0 or after < 0 else before + after
+
+    def place(self, booking_id, vid, a, b, category=None):
+        """Mette il noleggio sul veicolo; False se l'intervallo non è libero."""
+        with self.lock:
+            if vid not in self.fleet or self._gaps(vid, a, b) is None:
+                return False
+            bisect.insort(self.rentals[vid], (a, b, booking_id))
+            self.assigned[booking_id] = (vid, a, b, category)
+            return True
+
+    def release(self, booking_id):
+        with self.lock:
+            found = self.assigned.pop(booking_id, None)
+            if found:
+                vid, a, b, _ = found
+                self.rentals[vid].remove((a, b, booking_id))
+            return found
+
+    def allocate(self, booking_id, a, b, category=None, today=0):
+        """Assegna (o riassegna, se già presente) il noleggio [a, b). None se la flotta non basta."""
+        with self.lock:
+            previous = self.release(booking_id)
+            fits = [(self.fleet[vid] != category, gaps, vid) for vid in self.fleet
+                    for gaps in [self._gaps(vid, a, b)] if gaps is not None]
+            if fits:
+                vid = min(fits)[2]
+                self.place(booking_id, vid, a, b, category)
+                self.stats["allocated"] += 1
+                return {booking_id: vid}
+            moved = self.repack(today, extra=(a, b, booking_id, category))
+            if moved is None and previous:
+                self.place(booking_id, *previous)
+            return moved
+
+    def repack(self, today=0, extra=None):
+        """Riassegna tutti i noleggi non ancora iniziati (più 'extra', se dato) con pack_rentals()."""
+        with self.lock:
+            rentals = [(a, b, bid, cat, vid) for bid, (vid, a, b, cat) in self.assigned.items() if b > today]
+            if extra:
+                rentals.append((*extra, None))
+            plan = pack_rentals(self.fleet, rentals, today)
+            if plan is None:
+                self.stats["failed"] += 1
+                return None
+            moved = {bid: vid for bid, vid in plan.items() if self.assigned.get(bid, (None,))[0] != vid}
+            self.rentals = {vid: [] for vid in self.fleet}
+            self.assigned = {}
+            for a, b, bid, cat, _ in rentals:
+                self.place(bid, plan[bid], a, b, cat)
+            self.stats["repacks"] += 1
+            self.stats["moved"] += len(moved) - bool(extra)
+            if extra:
+                self.stats["allocated"] += 1
+            return moved
+
+    def report(self, min_gap=None):
+        """Noleggi, veicoli usati, buchi tra noleggi più corti di min_gap notti (invendibili) e categorie non rispettate."""
+        min_gap = PRODUCT["min_stay_nights"] if min_gap is None else min_gap
+        with self.lock:
+            orphan = sum(1 for items in self.rentals.values()
+                         for (_, end, _), (start, _, _) in zip(items, items[1:]) if 0 < start - end < min_gap)
+            return {**self.stats, "rentals": len(self.assigned),
+                    "vehicles_used": sum(1 for items in self.rentals.values() if items),
+                    "orphan_gaps": orphan,
+                    "upgrades": sum(1 for vid, _, _, cat in self.assigned.values()
+                                    if cat and self.fleet[vid] != cat)}
+
+CAR_FLEET = FleetAllocator()  # senza DB
+
+def car_category(room_type):
+    return ROOM_TYPES.get(room_type, {}).get("car_category")
+
+_FLEET_ROWS_SQL = """
+    SELECT booking_id, room_type, checkin, checkout, vehicle_id
+    FROM bookings
+    WHERE product_id = :product_id AND status <> 'cancelled' AND checkout > :today
+    ORDER BY checkin, id
+"""
+_FLEET_UPDATE_SQL = """
+    UPDATE bookings AS b SET vehicle_id = v.vehicle_id
+    FROM unnest(CAST(:booking_ids AS text[]), CAST(:vehicle_ids AS text[])) AS v(booking_id, vehicle_id)
+    WHERE b.booking_id = v.booking_id AND b.product_id = :product_id AND b.status <> 'cancelled'
+"""
+
+_FLEET_FIT_SQL = """
+    SELECT v.vehicle_id,
+           COUNT(b.id) FILTER (WHERE b.checkin < :checkout AND b.checkout > :checkin) AS busy,
+           MAX(b.checkout) FILTER (WHERE b.checkout <= :checkin) AS prev_end,
+           MIN(b.checkin) FILTER (WHERE b.checkin >= :checkout) AS next_start
+    FROM unnest(CAST(:vehicle_ids AS text[])) AS v(vehicle_id)
+    LEFT JOIN bookings b ON b.product_id = :product_id AND b.vehicle_id = v.vehicle_id
+         AND b.status <> 'cancelled' AND b.booking_id <> :booking_id
+         AND b.checkout > :since AND b.checkin < :until
+    GROUP BY v.vehicle_id
+"""
+_FLEET_CLAIM_SQL = """
+    UPDATE bookings SET vehicle_id = :vehicle_id
+    WHERE booking_id = :booking_id AND product_id = :product_id AND status <> 'cancelled'
+      AND NOT EXISTS (SELECT 1 FROM bookings o
+                      WHERE o.product_id = :product_id AND o.vehicle_id = :vehicle_id
+                        AND o.status <> 'cancelled' AND o.booking_id <> :booking_id
+                        AND o.checkin < :checkout AND o.checkout > :checkin)
+    RETURNING booking_id
+"""
+
+def _db_fit_car(booking_id, a, b, category, horizon=366):
+    """
+    Best fit incrementale con DB: sceglie il veicolo come FleetAllocator.allocate()
+    guardando solo i noleggi entro 'horizon' giorni, poi lo occupa con un UPDATE
+    condizionato sotto l'advisory lock del veicolo (e quello condiviso della
+    flotta, che esclude una riassegnazione completa in corso). Se un altro worker
+    lo occupa prima si prova il successivo. None se nessun veicolo ha [a, b) libero.
+    """
+    params = dict(product_id=PRODUCT["id"], booking_id=booking_id,
+                  checkin=date.fromordinal(a), checkout=date.fromordinal(b))
+    with engine.connect() as conn:
+        rows = conn.execute(text(_FLEET_FIT_SQL), dict(params, vehicle_ids=list(FLEET_CATEGORIES),
+                                                       since=date.fromordinal(a - horizon),
+                                                       until=date.fromordinal(b + horizon))).all()
+    fits = sorted((FLEET_CATEGORIES[vid] != category,
+                   (a - prev_end.toordinal() if prev_end else horizon)
+                   + (next_start.toordinal() - b if next_start else horizon), vid)
+                  for vid, busy, prev_end, next_start in rows if not busy)
+    for _, _, vid in fits:
+        with engine.begin() as conn:
+            conn.execute(text("SELECT pg_advisory_xact_lock_shared(hashtext(:fleet)), pg_advisory_xact_lock(hashtext(:vehicle))"),
+                         dict(fleet=f"fleet:{PRODUCT['id']}", vehicle=f"fleet:{PRODUCT['id']}:{vid}"))
+            if conn.execute(text(_FLEET_CLAIM_SQL), dict(params, vehicle_id=vid)).first():
+                CAR_FLEET.stats["allocated"] += 1
+                return {booking_id: vid}
+    return None
+
+def _fleet_update(change, today):
+    """
+    Applica change(allocator) alla flotta: senza DB su CAR_FLEET; con DB su un
+    allocator ricostruito dalle prenotazioni attive, scrivendo i veicoli
+    cambiati in bookings. Ritorna {booking_id: veicolo} cambiati (None se la flotta non basta).
+    """
+    if not engine:
+        return change(CAR_FLEET)
+    with engine.begin() as conn:
+        # un solo worker alla volta ricalcola le assegnazioni del prodotto, e nessun best fit incrementale in corso
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), dict(key=f"fleet:{PRODUCT['id']}"))
+        rows = conn.execute(text(_FLEET_ROWS_SQL), dict(product_id=PRODUCT["id"], today=date.fromordinal(today))).all()
+        alloc, loose = FleetAllocator(), []
+        for booking_id, room_type, checkin, checkout, vehicle_id in rows:
+            a, b = checkin.toordinal(), checkout.toordinal()
+            if not alloc.place(booking_id, vehicle_id, a, b, car_category(room_type)):
+                loose.append((booking_id, a, b, car_category(room_type)))
+        changed = {}
+        for booking_id, a, b, category in loose:   # es. prenotazioni precedenti alla flotta
+            changed.update(alloc.allocate(booking_id, a, b, category, today) or {})
+        before = dict(alloc.stats)
+        moved = change(alloc)
+        changed.update(moved or {})
+        if changed:
+            conn.execute(text(_FLEET_UPDATE_SQL), dict(product_id=PRODUCT["id"], booking_ids=list(changed),
+                                                       vehicle_ids=list(changed.values())))
+    for key, n in alloc.stats.items():
+        CAR_FLEET.stats[key] += n - before[key]
+    return moved
+
+def assign_car(booking_id, room_type, checkin, checkout, today=None):
+    """Assegna un veicolo alla prenotazione (anche dopo una modifica). Ritorna l'id del veicolo o None."""
+    today = (today or datetime.utcnow().date()).toordinal()
+    a, b, category = checkin.toordinal(), checkout.toordinal(), car_category(room_type)
+    moved = _db_fit_car(booking_id, a, b, category) if engine else None
+    if moved is None:   # senza DB, o flotta frammentata: allocate() con eventuale riassegnazione completa
+        moved = _fleet_update(lambda fleet: fleet.allocate(booking_id, a, b, category, today), today)
+    if moved is None:
+        app.logger.warning(f"Nessun veicolo libero per {booking_id} ({checkin} - {checkout})")
+        return None
+    return moved[booking_id]
+
+def release_car(booking_id, today=None):
+    """
+    Libera il veicolo della prenotazione cancellata e ricompatta le assegnazioni.
+    Con DB la prenotazione cancellata non conta già più: nessuna riassegnazione.
+    """
+    if engine:
+        return {}
+    today = (today or datetime.utcnow().date()).toordinal()
+
+    def _release(fleet):
+        fleet.release(booking_id)
+        return fleet.repack(today)
+    return _fleet_update(_release, today)
+
+def fleet_report():
+    """Senza DB lo stato di CAR_FLEET; con DB i contatori delle operazioni di questo processo."""
+    return {"vehicles": len(FLEET_CATEGORIES), **(CAR_FLEET.report() if not engine else CAR_FLEET.stats)}
+
+def vehicle_json(vehicle_id):
+    return {"id": vehicle_id, "category": FLEET_CATEGORIES[vehicle_id]} if vehicle_id in FLEET_CATEGORIES else None
+
+# ---------------------------
+#  Piano camere (assegnazione alle camere fisiche)
+# ---------------------------
+# Le camere di una tipologia sono intercambiabili e nessuna prenotazione è
+# legata a una camera: con soggiorni come intervalli, se in ogni notte le
+# prenotazioni non superano le camere (il controllo per giorno di
+# reserve_nights) un'assegnazione esiste sempre. Il piano serve quindi a
+# scegliere quella con meno notti orfane: buchi tra due soggiorni della stessa
+# camera più corti del soggiorno minimo, che non si possono più vendere.
+# Euristica: pack_rentals() (best fit in ordine di check-in); con al più
+# ROOM_EXACT_MAX prenotazioni nella finestra, ricerca esatta branch and bound.
+ROOMS = {rt: [f"{rt}-{i + 1}" for i in range(cfg.get("capacity", 0))] for rt, cfg in ROOM_TYPES.items()}
+
+def orphan_nights(plan, stays, min_gap=None):
+    """Notti nei buchi più corti di min_gap (default soggiorno minimo) tra soggiorni consecutivi della stessa camera."""
+    min_gap = PRODUCT["min_stay_nights"] if min_gap is None else min_gap
+    by_room = defaultdict(list)
+    for a, b, stay_id in stays:
+        by_room[plan[stay_id]].append((a, b))
+    total = 0
+    for items in by_room.values():
+        items.sort()
+        total += sum(gap for (_, end), (start, _) in zip(items, items[1:]) if 0 < (gap := start - end) < min_gap)
+    return total
+
+def _exact_room_plan(rooms, stays, best_cost, min_gap):
+    """Branch and bound sulle assegnazioni in ordine di check-in; camere mai usate equivalenti. None se non migliora best_cost."""
+    order = sorted(stays)
+    free_at = dict.fromkeys(rooms, None)
+    current, best = {}, [best_cost, None]
+
+    def _search(i, cost):
+        if cost >= best[0]:
+            return
+        if i == len(order):
+            best[:] = [cost, dict(current)]
+            return
+        a, b, stay_id = order[i]
+        tried_empty = False
+        for room in rooms:
+            last = free_at[room]
+            if last is None:
+                if tried_empty:
+                    continue
+                tried_empty, extra = True, 0
+            elif last > a:
+                continue
+            else:
+                extra = a - last if 0 < a - last < min_gap else 0
+            free_at[room], current[stay_id] = b, room
+            _search(i + 1, cost + extra)
+            free_at[room] = last
+        current.pop(stay_id, None)
+
+    _search(0, 0)
+    return best[1]
+
+def plan_rooms(rooms, stays, exact_max=None, min_gap=None):
+    """
+    Assegna i soggiorni [(check-in, check-out, id)] (ordinali) alle camere.
+    Ritorna (piano {id: camera}, notti orfane, "heuristic" o "exact"), o
+    (None, None, None) se in qualche notte i soggiorni superano le camere.
+    """
+    exact_max = ROOM_EXACT_MAX if exact_max is None else exact_max
+    min_gap = PRODUCT["min_stay_nights"] if min_gap is None else min_gap
+    plan = pack_rentals({room: "" for room in rooms}, [(a, b, i, "", None) for a, b, i in stays])
+    if plan is None:
+        return None, None, None
+    cost, method = orphan_nights(plan, stays, min_gap), "heuristic"
+    if 0 < cost and len(stays) <= exact_max:
+        better = _exact_room_plan(rooms, stays, cost, min_gap)
+        if better:
+            plan, cost = better, orphan_nights(better, stays, min_gap)
+        method = "exact"
+    return plan, cost, method
+
+def room_plan(room_type, start, end, exact_max=None):
+    """Piano camere della tipologia per i soggiorni attivi che toccano [start, end)."""
+    if engine:
+        with engine.begin() as conn:
+            rows = conn.execute(text("""
+                SELECT booking_id, checkin, checkout FROM bookings
+                WHERE product_id = :product_id AND room_type = :room_type AND status <> 'cancelled'
+                  AND checkin < :end AND checkout > :start
+            """), dict(product_id=PRODUCT["id"], room_type=room_type, start=start, end=end)).all()
+    else:
+        rows = [(bid, r["checkin"], r["checkout"]) for bid, r in list(BOOKING_RECORDS.items())
+                if r["room_type"] == room_type and r["status"] != "cancelled"
+                and r["checkin"] < end and r["checkout"] > start]
+    stays = [(ci.toordinal(), co.toordinal(), bid) for bid, ci, co in rows]
+    plan, orphans, method = plan_rooms(ROOMS[room_type], stays, exact_max)
+    return {"room_type": room_type, "rooms": ROOMS[room_type], "bookings": len(stays),
+            "method": method, "orphan_nights": orphans,
+            "plan": {room: [{"booking_id": bid, "checkin": date.fromordinal(a).isoformat(),
+                             "checkout": date.fromordinal(b).isoformat()}
+                            for a, b, bid in sorted(stays) if plan and plan[bid] == room]
+                     for room in ROOMS[room_type]}}
+
+def room_plan_report(bookings=5000, rooms=60, days=365, exact_windows=200, seed=0):
+    """
+    Benchmark su una stagione sintetica: 'bookings' tentativi di soggiorno
+    (2-10 notti) accettati con il controllo per giorno su 'rooms' camere.
+    Confronta notti orfane e tempi di first fit (prima camera libera) ed
+    euristica; poi euristica contro solver esatto su 'exact_windows' orizzonti
+    brevi (3 camere, 30 notti, al più ROOM_EXACT_MAX soggiorni).
+    """
+    rnd = np.random.default_rng(seed)
+    nights = np.zeros(days + 16, dtype=np.int64)
+    stays = []
+    for i, (a, n) in enumerate(zip(rnd.integers(0, days, bookings), rnd.integers(2, 11, bookings))):
+        if nights[a:a + n].max() < rooms:
+            nights[a:a + n] += 1
+            stays.append((int(a), int(a + n), i))
+    names = [f"R{i}" for i in range(rooms)]
 
-COUPONS = {"WELCOME10": 0.10, "STUDENT5": 0.05}
+    t0 = time.perf_counter()
+    free_at, first_fit = [0] * rooms, {}
+    for a, b, i in sorted(stays):
+        r = next(r for r in range(rooms) if free_at[r] <= a)
+        free_at[r], first_fit[i] = b, names[r]
+    first_fit_ms = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    plan, orphans, _ = plan_rooms(names, stays, exact_max=0)
+    heuristic_ms = (time.perf_counter() - t0) * 1000
 
-# Capacità in memoria (demo); il DB salva solo le prenotazioni
-BOOKINGS = defaultdict(int)  # key = "YYYY-MM-DD" -> count
+    window, small = ROOM_EXACT_MAX, names[:3]
+    heur, exact, exact_ms = 0, 0, 0.0
+    for _ in range(exact_windows):
+        # orizzonte breve (30 notti, 3 camere): fino a ROOM_EXACT_MAX soggiorni accettati
+        occupied, part = np.zeros(40, dtype=np.int64), []
+        for a, n in zip(rnd.integers(0, 30, 4 * window), rnd.integers(2, 8, 4 * window)):
+            if len(part) < window and occupied[a:a + n].max() < len(small):
+                occupied[a:a + n] += 1
+                part.append((int(a), int(a + n), len(part)))
+        _, c, _ = plan_rooms(small, part, exact_max=0)
+        t0 = time.perf_counter()
+        _, c_exact, _ = plan_rooms(small, part, exact_max=window)
+        exact_ms += (time.perf_counter() - t0) * 1000
+        heur, exact = heur + c, exact + c_exact
+    return {
+        "bookings": len(stays), "rooms": rooms, "days": days,
+        "first_fit": {"orphan_nights": orphan_nights(first_fit, stays), "ms": round(first_fit_ms, 1)},
+        "heuristic": {"orphan_nights": orphans, "ms": round(heuristic_ms, 1)},
+        "exact_windows": {"window": window, "windows": exact_windows, "heuristic_orphan_nights": heur,
+                          "exact_orphan_nights": exact, "ms": round(exact_ms, 1)},
+    }
 
 # ---------------------------
-#  Util
+#  Lista d'attesa
 # ---------------------------
-def parse_date(s: str):
-    """Accetta 'YYYY-MM-DD' o 'DD/MM/YYYY' e ritorna date()."""
-    s = (s or "").strip()
-    for fmt in ("%Y-%m-%d", "%d/%m/%Y"):
-        try:
-            return datetime.strptime(s, fmt).date()
-        except ValueError:
-            continue
-    raise ValueError(f"Data non valida: '{s}'. Usa formato YYYY-MM-DD o DD/MM/YYYY")
+# Chi trova un soggiorno esaurito si iscrive con le sue date (/waitlist). Quando
+# delle notti tornano libere (cancellazione, modifica, hold scaduto) si
+# esaminano solo le richieste che toccano quelle notti, in ordine di
+# iscrizione: a chi ora trova posto si crea un hold di HOLD_TTL_MINUTES al
+# prezzo attuale (da confermare con /book) e si invia l'offerta. Senza DB le
+# richieste stanno in WAITLIST, indicizzate da WaitlistIndex (per processo, al
+# più WAITLIST_MAX); con DB nella tabella waitlist, con un indice GiST sugli
+# intervalli di date, e un solo worker alla volta abbina (advisory lock).
+class WaitlistIndex:
+    """
+    Richieste indicizzate per notti [a, b) (ordinali): segment tree implicito
+    sugli ordinali, ogni richiesta registrata nei O(log n) nodi canonici del suo
+    intervallo. Le richieste che toccano [x, y) stanno negli antenati delle
+    foglie x..y-1: si visitano O(y - x + log n) nodi, non tutte le richieste.
+    """
+    LEAVES = 1 << 20   # ordinali fino all'anno 2870
 
-def daterange(d1, d2):
-    cur = d1
-    while cur < d2:
-        yield cur
-        cur += timedelta(days=1)
+    def __init__(self):
+        self.nodes = defaultdict(set)
 
-def is_blackout(d): return d.strftime("%Y-%m-%d") in PRODUCT["blackout_dates"]
+    def _canonical(self, a, b):
+        l, r = a + self.LEAVES, b + self.LEAVES
+        while l < r:
+            if l & 1:
+                yield l
+                l += 1
+            if r & 1:
+                r -= 1
+                yield r
+            l, r = l >> 1, r >> 1
 
-def season_factor(d):
-    for s in SEASON_FACTORS:
-        if parse_date(s["from"]) <= d <= parse_date(s["to"]):
-            return s["factor"]
-    return 1.0
+    def add(self, key, a, b):
+        for node in self._canonical(a, b):
+            self.nodes[node].add(key)
 
-def advance_discount(today, checkin):
-    days = (checkin - today).days
-    for tier in ADVANCE_TIERS:
-        if days >= tier["days"]:
-            return tier["discount"]
-    return 0.0
+    def remove(self, key, a, b):
+        for node in self._canonical(a, b):
+            keys = self.nodes.get(node)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self.nodes[node]
 
-def valid_capacity(d):
-    return BOOKINGS[d.strftime("%Y-%m-%d")] < PRODUCT["capacity_per_day"]
+    def overlapping(self, x, y):
+        """Chiavi delle richieste che hanno almeno una notte in [x, y)."""
+        found = set()
+        l, r = x + self.LEAVES, y - 1 + self.LEAVES
+        while l and l <= r:
+            for node in range(l, r + 1):
+                found.update(self.nodes.get(node, ()))
+            l, r = l >> 1, r >> 1
+        return found
 
-def quote_price(checkin, checkout, guests, *, coupon=None, today=None, room_type="standard"):
-    room_type = (room_type or "standard").lower()
-    if room_type not in ROOM_TYPES:
-        return (False, f"Tipologia camera non valida: {room_type}", None)
+WAITLIST = {}         # seq -> richiesta (solo senza DB)
+WAITLIST_IDS = {}     # waitlist_id -> seq
+WAITLIST_HOLDS = {}   # hold_id -> seq delle richieste offerte, finché l'hold è aperto
+WAITLIST_INDEX = WaitlistIndex()
+_WAITLIST_LOCK = threading.Lock()
+_WAITLIST_MATCHING = threading.Lock()   # un abbinamento alla volta (senza DB)
+_WAITLIST_SEQ = [0]
+WAITLIST_STATS = {"joined": 0, "offered": 0, "examined": 0, "matches": 0, "waiting": 0}
 
-    RT = ROOM_TYPES[room_type]
-    if guests < 1 or guests > RT["max_guests"]:
-        return (False, f"Ospiti non validi per {room_type} (max {RT['max_guests']})", None)
+_WAITLIST_MATCH_SQL = """
+    SELECT w.waitlist_id, w.room_type, w.checkin, w.checkout, w.guests, w.customer_name, w.customer_email
+    FROM waitlist w
+    WHERE w.id IN (
+        SELECT c.id
+        FROM unnest(CAST(:lo AS date[]), CAST(:hi AS date[])) AS r(lo, hi)
+        JOIN waitlist c ON daterange(c.checkin, c.checkout) && daterange(r.lo, r.hi)
+        WHERE c.product_id = :product_id AND c.status = 'waiting'
+    )
+    ORDER BY w.id
+"""
 
-    nights = (checkout - checkin).days
-    if nights < PRODUCT["min_stay_nights"]:
-        return (False, f"Soggiorno minimo {PRODUCT['min_stay_nights']} notti", None)
+def day_ranges(days):
+    """Date (anche non ordinate) -> intervalli [inizio, fine) di ordinali consecutivi."""
+    ranges = []
+    for o in sorted({d.toordinal() for d in days}):
+        if ranges and ranges[-1][1] == o:
+            ranges[-1][1] = o + 1
+        else:
+            ranges.append([o, o + 1])
+    return [tuple(r) for r in ranges]
 
-    for d in daterange(checkin, checkout):
-        if is_blackout(d):        return (False, f"Data non disponibile: {d}", None)
-        if not valid_capacity(d): return (False, f"Capacità esaurita nel giorno: {d}", None)
+def join_waitlist(checkin, checkout, guests, room_type, customer):
+    """Iscrive la richiesta. Ritorna il dict della richiesta, o None se la lista (senza DB) è piena."""
+    entry = dict(waitlist_id=f"WL-{secrets.token_hex(8)}", room_type=room_type, checkin=checkin,
+                 checkout=checkout, guests=guests, customer_name=customer.get("name", ""),
+                 customer_email=customer.get("email", ""), status="waiting", hold_id=None)
+    if engine:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO waitlist
+                (waitlist_id, product_id, room_type, checkin, checkout, guests, customer_name, customer_email)
+                VALUES (:waitlist_id, :product_id, :room_type, :checkin, :checkout, :guests,
+                        :customer_name, :customer_email)
+            """), dict(entry, product_id=PRODUCT["id"]))
+    else:
+        with _WAITLIST_LOCK:
+            if WAITLIST_STATS["waiting"] >= WAITLIST_MAX:
+                return None
+            _WAITLIST_SEQ[0] += 1
+            seq = _WAITLIST_SEQ[0]
+            WAITLIST[seq] = entry
+            WAITLIST_IDS[entry["waitlist_id"]] = seq
+            WAITLIST_INDEX.add(seq, checkin.toordinal(), checkout.toordinal())
+            WAITLIST_STATS["waiting"] += 1
+    WAITLIST_STATS["joined"] += 1
+    return entry
 
-    total = 0.0
-    for d in daterange(checkin, checkout):
-        total += RT["base_price_per_night"] * season_factor(d)
+def waitlist_entry(waitlist_id, email):
+    """Richiesta con il suo stato (waiting / offered), o None se non trovata o email diversa."""
+    if engine:
+        with engine.begin() as conn:
+            row = conn.execute(text("""
+                SELECT w.waitlist_id, w.room_type, w.checkin, w.checkout, w.guests, w.customer_name,
+                       w.customer_email, w.status, w.hold_id, h.expires_at, h.total_price
+                FROM waitlist w LEFT JOIN holds h ON h.hold_id = w.hold_id
+                WHERE w.waitlist_id = :waitlist_id AND w.product_id = :product_id
+                  AND lower(w.customer_email) = lower(:email)
+            """), dict(waitlist_id=waitlist_id, product_id=PRODUCT["id"], email=email)).mappings().first()
+        return dict(row) if row else None
+    with _WAITLIST_LOCK:
+        entry = WAITLIST.get(WAITLIST_IDS.get(waitlist_id))
+        entry = dict(entry) if entry and entry["customer_email"].lower() == (email or "").lower() else None
+    if entry and entry["hold_id"]:
+        hold = HOLDS.get(entry["hold_id"])
+        entry.update(expires_at=hold and hold["expires_at"], total_price=hold and hold["total_price"])
+    return entry
 
-    if guests > 2:
-        total *= (1 + 0.10 * (guests - 2))  # +10% per ospite oltre 2
+def _waitlist_offered(entry, hold, conn=None):
+    """Segna la richiesta come servita: esce dall'indice (senza DB) o passa a 'offered' (con DB)."""
+    if conn is not None:
+        conn.execute(text("""
+            UPDATE waitlist SET status = 'offered', hold_id = :hold_id, offered_at = NOW()
+            WHERE waitlist_id = :waitlist_id
+        """), dict(waitlist_id=entry["waitlist_id"], hold_id=hold["hold_id"]))
+        return
+    with _WAITLIST_LOCK:
+        seq = WAITLIST_IDS[entry["waitlist_id"]]
+        WAITLIST_INDEX.remove(seq, entry["checkin"].toordinal(), entry["checkout"].toordinal())
+        entry.update(status="offered", hold_id=hold["hold_id"])
+        WAITLIST_HOLDS[hold["hold_id"]] = seq
+        WAITLIST_STATS["waiting"] -= 1
 
-    if not today:
-        today = datetime.utcnow().date()
-    total *= (1 - advance_discount(today, checkin))
+def _waitlist_hold_closed(hold_ids):
+    """Senza DB: l'hold dell'offerta è stato prenotato o è scaduto, la richiesta esce dalla lista."""
+    with _WAITLIST_LOCK:
+        for hold_id in hold_ids:
+            seq = WAITLIST_HOLDS.pop(hold_id, None)
+            if seq is not None:
+                WAITLIST_IDS.pop(WAITLIST.pop(seq)["waitlist_id"], None)
 
-    if coupon and coupon in COUPONS:
-        total *= (1 - COUPONS[coupon])
+def _offer(entries, ranges, conn=None, created=None):
+    lo, hi = date.fromordinal(min(a for a, _ in ranges)), date.fromordinal(max(b for _, b in ranges))
+    offered = []
+    for entry in entries:
+        if not (inventory_free(lo, hi) > 0).any():
+            break   # le notti liberate sono di nuovo tutte occupate
+        WAITLIST_STATS["examined"] += 1
+        ok, _, price = quote_price(entry["checkin"], entry["checkout"], entry["guests"],
+                                   room_type=entry["room_type"])
+        if not ok:
+            continue
+        hold = create_hold(entry["checkin"], entry["checkout"], entry["guests"], entry["room_type"], price)
+        if hold is None:
+            break   # troppi hold in corso: si riprova alla prossima liberazione
+        if not hold:
+            continue
+        if created is not None:
+            created.append(hold["hold_id"])
+        _waitlist_offered(entry, hold, conn)
+        offered.append(dict(entry, status="offered", hold_id=hold["hold_id"], total_price=price,
+                            expires_at=hold["expires_at"]))
+    return offered
 
-    return (True, "ok", round(total, 2))
+def match_waitlist(ranges):
+    """
+    Offre le notti liberate (ranges = [(inizio, fine)] in ordinali) alle
+    richieste che le toccano, in ordine di iscrizione. Ritorna le richieste servite.
+    """
+    ranges = [(a, b) for a, b in ranges if a < b]
+    if not ranges:
+        return []
+    WAITLIST_STATS["matches"] += 1
+    if engine:
+        created = []
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"),
+                             dict(key=f"waitlist:{PRODUCT['id']}"))
+                rows = conn.execute(text(_WAITLIST_MATCH_SQL), dict(
+                    product_id=PRODUCT["id"], lo=[date.fromordinal(a) for a, _ in ranges],
+                    hi=[date.fromordinal(b) for _, b in ranges])).mappings().all()
+                offered = _offer([dict(r) for r in rows], ranges, conn, created)
+        except Exception:
+            # gli hold nascono in autocommit: se lo stato 'offered' va in rollback
+            # nessuno li confermerebbe, quindi si cancellano e le notti tornano libere
+            if created:
+                _db_drop_holds("hold_id = ANY(:hold_ids)", hold_ids=created)
+            raise
+    else:
+        with _WAITLIST_MATCHING:
+            with _WAITLIST_LOCK:
+                keys = set().union(*(WAITLIST_INDEX.overlapping(a, b) for a, b in ranges))
+                entries = [WAITLIST[k] for k in sorted(keys)]
+            offered = _offer(entries, ranges)
+    WAITLIST_STATS["offered"] += len(offered)
+    for entry in offered:
+        send_waitlist_email(entry)
+    return offered
 
-# ---------------------------
-#  Init DB (se disponibile)
-# ---------------------------
-def init_db():
-    if not engine:
-        return
-    with engine.begin() as conn:
-        conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS bookings (
-            id SERIAL PRIMARY KEY,
-            booking_id VARCHAR(32) NOT NULL,
-            product_id VARCHAR(64) NOT NULL,
-            room_type VARCHAR(32) NOT NULL,
-            checkin DATE NOT NULL,
-            checkout DATE NOT NULL,
-            guests INTEGER NOT NULL,
-            total_price NUMERIC(10,2) NOT NULL,
-            customer_name TEXT NOT NULL,
-            customer_email TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT NOW()
-        );
-        """))
+def notify_released(ranges):
+    """match_waitlist() best-effort: chi ha liberato le notti non deve vedere errori della lista d'attesa."""
+    try:
+        return match_waitlist(ranges)
+    except Exception as e:
+        app.logger.warning(f"Lista d'attesa non aggiornata: {e}")
+        return []
 
-if engine:
-    from sqlalchemy import text  # import qui per sicurezza
-    init_db()
+def waitlist_stats():
+    """Contatori di questo processo; 'waiting' solo senza DB."""
+    return {**WAITLIST_STATS, "waiting": WAITLIST_STATS["waiting"] if not engine else None}
 
 # ---------------------------
 #  Routes pubbliche
@@ -213,8 +2788,16 @@ def root():
         "service": "sicily-pricing-engine-v1",
         "endpoints": {
             "availability": "/availability?date=YYYY-MM-DD",
+            "availability_range": "/availability/range?from=YYYY-MM-DD&to=YYYY-MM-DD&room_type=standard",
             "quote": "/quote (POST)",
+            "quote_batch": "/quote/batch (POST)",
+            "quote_compare": "/quote/compare (POST)",
+            "calendar": "/calendar?month=YYYY-MM&nights=3&guests=2&room_type=standard",
+            "search": "/search (POST)",
+            "hold": "/hold (POST)",
             "book": "/book (POST)",
+            "cancel": "/cancel (POST)",
+            "modify": "/modify (POST)",
             "health": "/healthz"
         }
     }, 200
@@ -231,10 +2814,142 @@ def availability():
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 400
 
+    room_type = (request.args.get("room_type") or "").lower()
+    if room_type and room_type not in ROOM_TYPES:
+        return jsonify({"ok": False, "error": f"Tipologia camera non valida: {room_type}"}), 400
+
     if is_blackout(d):
         return jsonify({"ok": True, "available": False, "reason": "blackout"})
-    slots = PRODUCT["capacity_per_day"] - BOOKINGS[d.strftime("%Y-%m-%d")]
-    return jsonify({"ok": True, "available": slots > 0, "slots": max(0, slots)})
+    free = dict(zip(ROOM_TYPES, inventory_free(d, d + timedelta(days=1))[:, 0].tolist()))
+    if room_type:
+        slots = free[room_type]
+    else:
+        # camere libere di tutte le tipologie, limitate dai pool condivisi (auto)
+        shared = [POOLS[p] - inventory_count(p, d) for p in PRODUCT.get("shared_pools", {})]
+        slots = sum(POOLS[rt] - inventory_count(rt, d) if rt in POOLS else free[rt] for rt in ROOM_TYPES)
+        slots = min([slots] + shared)
+    return jsonify({"ok": True, "available": slots > 0, "slots": max(0, slots),
+                    "by_room_type": {rt: max(0, n) for rt, n in free.items()}})
+
+@app.route("/availability/range", methods=["GET"])
+def availability_range():
+    """
+    Calendario disponibilità per il datepicker: per ogni giorno da 'from' a 'to'
+    (inclusi) posti liberi, blackout e tariffa della notte. Con ETag: una
+    richiesta con If-None-Match uguale riceve 304 senza corpo.
+    """
+    try:
+        start = parse_date(request.args.get("from"))
+        end = parse_date(request.args.get("to")) + timedelta(days=1)
+        room_type = (request.args.get("room_type") or "standard").lower()
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    if room_type not in ROOM_TYPES:
+        return jsonify({"ok": False, "error": f"Tipologia camera non valida: {room_type}"}), 400
+    if not 0 < (end - start).days <= AVAILABILITY_RANGE_MAX:
+        return jsonify({"ok": False, "error": f"Intervallo non valido: da 1 a {AVAILABILITY_RANGE_MAX} giorni"}), 400
+
+    free = inventory_free(start, end)[list(ROOM_TYPES).index(room_type)].tolist()
+    days = []
+    for i, (n, blackout, rate) in enumerate(zip(free, blackout_flags(start, end),
+                                                nightly_rates(room_type, start, end))):
+        slots = max(0, n)
+        days.append({"date": (start + timedelta(days=i)).isoformat(),
+                     "available": slots > 0 and not blackout,
+                     "slots": slots, "blackout": blackout, "price": round(rate, 2)})
+    resp = jsonify({"ok": True, "product": PRODUCT["id"], "room_type": room_type,
+                    "currency": "EUR", "days": days})
+    resp.add_etag()
+    resp.cache_control.public = True
+    resp.cache_control.no_cache = True  # la CDN può tenerla ma deve rivalidare
+    return resp.make_conditional(request)
+
+@app.route("/calendar", methods=["GET"])
+def price_calendar():
+    """
+    Calendario prezzi per le date flessibili: per ogni check-in del mese
+    (month=YYYY-MM) il totale di un soggiorno di 'nights' notti, oppure il
+    motivo per cui non è prenotabile (min_stay, blackout, capacity).
+    Tutti i check-in in un solo quote_price_batch: somme prefisse sulle
+    tariffe compilate, non un quote_price() per giorno.
+    """
+    month = (request.args.get("month") or "").strip()
+    try:
+        first = date.fromisoformat(f"{month}-01") if len(month) == 7 else None
+    except ValueError:
+        first = None
+    if not first:
+        return jsonify({"ok": False, "error": f"Mese non valido: '{month}'. Usa formato YYYY-MM"}), 400
+    try:
+        nights = int(request.args.get("nights", PRODUCT["min_stay_nights"]))
+        guests = int(request.args.get("guests", 2))
+        room_type = (request.args.get("room_type") or "standard").lower()
+        coupon = request.args.get("coupon")
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"Parametri non validi: {e}"}), 400
+    if room_type not in ROOM_TYPES:
+        return jsonify({"ok": False, "error": f"Tipologia camera non valida: {room_type}"}), 400
+    if guests < 1 or guests > ROOM_TYPES[room_type]["max_guests"]:
+        return jsonify({"ok": False, "error": f"Ospiti non validi per {room_type} (max {ROOM_TYPES[room_type]['max_guests']})"}), 400
+    if not 0 < nights <= AVAILABILITY_RANGE_MAX:
+        return jsonify({"ok": False, "error": f"Notti non valide: da 1 a {AVAILABILITY_RANGE_MAX}"}), 400
+
+    try:
+        last = date(first.year + first.month // 12, first.month % 12 + 1, 1)
+        date.fromordinal(last.toordinal() - 1 + nights)   # ultimo check-out entro date.max
+    except (ValueError, OverflowError):
+        return jsonify({"ok": False, "error": f"Mese non valido: '{month}'. Fuori dal calendario"}), 400
+    checkins = np.arange(first.toordinal(), last.toordinal(), dtype=np.int64)
+    prices, codes = quote_price_batch(checkins, checkins + nights, np.full(checkins.shape, guests),
+                                      [room_type] * len(checkins), [coupon] * len(checkins),
+                                      today=datetime.utcnow().date())
+    days, cheapest = [], None
+    for o, price, code in zip(checkins.tolist(), prices.tolist(), codes.tolist()):
+        cell = {"checkin": date.fromordinal(o).isoformat(), "available": code == QUOTE_OK}
+        if code == QUOTE_OK:
+            cell["total_price"] = price
+            if cheapest is None or price < cheapest["total_price"]:
+                cheapest = cell
+        else:
+            cell["reason"] = QUOTE_ERR_REASONS[code]
+        days.append(cell)
+    resp = jsonify({"ok": True, "product": PRODUCT["id"], "room_type": room_type,
+                    "month": first.strftime("%Y-%m"), "nights": nights, "guests": guests,
+                    "currency": "EUR", "cheapest": cheapest and cheapest["checkin"], "days": days})
+    resp.add_etag()
+    resp.cache_control.public = True
+    resp.cache_control.no_cache = True
+    return resp.make_conditional(request)
+
+@app.route("/search", methods=["POST"])
+def search():
+    data = request.json or {}
+    try:
+        start = parse_date(data["from"])
+        end = parse_date(data["to"])
+        guests = int(data["guests"])
+        min_nights = int(data.get("min_nights", PRODUCT["min_stay_nights"]))
+        max_nights = int(data.get("max_nights", min_nights))
+        room_types = [str(rt).lower() for rt in data.get("room_types") or []]
+        coupon = data.get("coupon")
+        limit = int(data.get("limit", 10))
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"Parametri non validi: {e}"}), 400
+    unknown = [rt for rt in room_types if rt not in ROOM_TYPES]
+    if unknown:
+        return jsonify({"ok": False, "error": f"Tipologia camera non valida: {unknown[0]}"}), 400
+    if not 0 < (end - start).days <= AVAILABILITY_RANGE_MAX:
+        return jsonify({"ok": False, "error": f"Intervallo non valido: da 1 a {AVAILABILITY_RANGE_MAX} giorni"}), 400
+    if not 0 < min_nights <= max_nights <= (end - start).days:
+        return jsonify({"ok": False, "error": f"Notti non valide: serve 0 < min_nights <= max_nights "
+                                              f"<= {(end - start).days} (giorni tra from e to)"}), 400
+    if not 0 < limit <= SEARCH_MAX_RESULTS:
+        return jsonify({"ok": False, "error": f"Limite non valido: da 1 a {SEARCH_MAX_RESULTS}"}), 400
+
+    results = cheapest_stays(start, end, min_nights, max_nights, guests, room_types,
+                             coupon=coupon, k=limit, today=datetime.utcnow().date())
+    return jsonify({"ok": True, "product": PRODUCT["id"], "count": len(results),
+                    "currency": "EUR", "results": results})
 
 @app.route("/quote", methods=["POST"])
 def quote():
@@ -248,7 +2963,10 @@ def quote():
     except Exception as e:
         return jsonify({"ok": False, "error": f"Parametri non validi: {e}"}), 400
 
-    ok, msg, price = quote_price(checkin, checkout, guests, coupon=coupon, room_type=room_type)
+    today = datetime.utcnow().date()
+    ok, msg, price = single_flight(
+        ("quote", checkin, checkout, guests, room_type, coupon, today),
+        lambda: cached_quote_price(checkin, checkout, guests, coupon=coupon, today=today, room_type=room_type))
     if not ok:
         return jsonify({"ok": False, "error": msg}), 400
 
@@ -261,9 +2979,137 @@ def quote():
         "currency": "EUR"
     })
 
+@app.route("/quote/compare", methods=["POST"])
+def quote_compare():
+    """Tabella di confronto: /quote per ogni tipologia che accetta gli ospiti, in un solo calcolo."""
+    data = request.json or {}
+    try:
+        checkin  = parse_date(data["checkin"])
+        checkout = parse_date(data["checkout"])
+        guests   = int(data["guests"])
+        coupon   = data.get("coupon")
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"Parametri non validi: {e}"}), 400
+
+    today = datetime.utcnow().date()
+    quotes = single_flight(
+        ("quote_compare", checkin, checkout, guests, coupon, today),
+        lambda: quote_price_all(checkin, checkout, guests, coupon=coupon, today=today))
+    items = []
+    for rt, (ok, code, msg, price) in quotes.items():
+        item = {"room_type": rt, "available": ok}
+        if ok:
+            item["total_price"] = price
+        else:
+            item.update(reason=QUOTE_ERR_REASONS[code], error=msg)
+        items.append(item)
+    return jsonify({
+        "ok": True,
+        "product": PRODUCT["id"],
+        "nights": (checkout - checkin).days,
+        "guests": guests,
+        "currency": "EUR",
+        "room_types": items
+    })
+
+@app.route("/quote/batch", methods=["POST"])
+def quote_batch():
+    data = request.json
+    items = data.get("items") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return jsonify({"ok": False, "error": "Parametri non validi: serve una lista 'items'"}), 400
+    if len(items) > QUOTE_BATCH_MAX:
+        return jsonify({"ok": False, "error": f"Troppi preventivi: max {QUOTE_BATCH_MAX}"}), 400
+
+    results = [None] * len(items)
+    parsed = []  # (posizione, checkin, checkout, guests, coupon, room_type)
+    for i, item in enumerate(items):
+        try:
+            parsed.append((i,
+                           parse_date(item["checkin"]),
+                           parse_date(item["checkout"]),
+                           int(item["guests"]),
+                           optional_str(item, "coupon"),
+                           (optional_str(item, "room_type") or "standard").lower()))
+        except Exception as e:
+            results[i] = {"ok": False, "error": f"Parametri non validi: {e}"}
+
+    if parsed:
+        today = datetime.utcnow().date()
+        pos, checkins, checkouts, guests, coupons, room_types = zip(*parsed)
+        prices, codes = quote_price_batch([d.toordinal() for d in checkins],
+                                          [d.toordinal() for d in checkouts],
+                                          guests, room_types, coupons, today=today)
+        for k, i in enumerate(pos):
+            price = float(prices[k])
+            if codes[k] != QUOTE_OK:
+                # il messaggio (con il giorno non disponibile) lo compone il percorso scalare
+                ok, msg, price = quote_price(checkins[k], checkouts[k], guests[k], coupon=coupons[k],
+                                             today=today, room_type=room_types[k])
+                if not ok:
+                    results[i] = {"ok": False, "error": msg}
+                    continue
+            results[i] = {
+                "ok": True,
+                "product": PRODUCT["id"],
+                "room_type": room_types[k],
+                "nights": (checkouts[k] - checkins[k]).days,
+                "total_price": price,
+                "currency": "EUR"
+            }
+
+    return jsonify({"ok": True, "count": len(results), "results": results})
+
+@app.route("/hold", methods=["POST"])
+def hold():
+    """Blocca le notti per il tempo del pagamento; /book con hold_id le conferma."""
+    if not HOLDS_ENABLED:
+        return jsonify({"ok": False, "error": "Hold non disponibili con l'inventario in shared memory"}), 501
+    data = request.json or {}
+    try:
+        checkin   = parse_date(data["checkin"])
+        checkout  = parse_date(data["checkout"])
+        guests    = int(data["guests"])
+        room_type = (data.get("room_type") or "standard").lower()
+        minutes   = float(data["minutes"]) if data.get("minutes") is not None else HOLD_TTL_MINUTES
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"Parametri non validi: {e}"}), 400
+    if not (math.isfinite(minutes) and minutes > 0):
+        return jsonify({"ok": False, "error": "minutes deve essere un numero positivo"}), 400
+
+    ok, msg, price = quote_price(checkin, checkout, guests, coupon=data.get("coupon"), room_type=room_type)
+    if not ok:
+        return jsonify({"ok": False, "error": msg}), 400
+    try:
+        held = create_hold(checkin, checkout, guests, room_type, price, minutes,
+                           coupon=applied_coupon(data.get("coupon")))
+    except InventoryRangeError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"Errore salvataggio DB: {e}"}), 500
+    if held is None:
+        return jsonify({"ok": False, "error": "Troppi hold in corso, riprova tra poco"}), 503
+    if not held:
+        return jsonify({"ok": False, "error": "Capacità esaurita per le date richieste"}), 400
+
+    return jsonify({
+        "ok": True,
+        "hold_id": held["hold_id"],
+        "product": PRODUCT["id"],
+        "room_type": room_type,
+        "checkin": checkin.strftime("%Y-%m-%d"),
+        "checkout": checkout.strftime("%Y-%m-%d"),
+        "guests": guests,
+        "total_price": price,
+        "expires_at": held["expires_at"].strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "status": "held"
+    })
+
 @app.route("/book", methods=["POST"])
 def book():
     data = request.json or {}
+    if data.get("hold_id"):
+        return _book_from_hold(data)
     try:
         checkin   = parse_date(data["checkin"])
         checkout  = parse_date(data["checkout"])
@@ -277,34 +3123,28 @@ def book():
     if not ok:
         return jsonify({"ok": False, "error": msg}), 400
 
-    # blocco capacità (demo in memoria)
-    for d in daterange(checkin, checkout):
-        BOOKINGS[d.strftime("%Y-%m-%d")] += 1
-
-    booking_id = f"BK-{int(datetime.utcnow().timestamp())}"
+    booking_id = new_booking_id()
 
-    # salva su DB se configurato
-    if engine:
-        try:
-            with engine.begin() as conn:
-                conn.execute(text("""
-                    INSERT INTO bookings
-                    (booking_id, product_id, room_type, checkin, checkout, guests, total_price, customer_name, customer_email)
-                    VALUES
-                    (:booking_id, :product_id, :room_type, :checkin, :checkout, :guests, :total_price, :customer_name, :customer_email)
-                """), dict(
-                    booking_id=booking_id,
-                    product_id=PRODUCT["id"],
-                    room_type=room_type,
-                    checkin=checkin.isoformat(),
-                    checkout=checkout.isoformat(),
-                    guests=guests,
-                    total_price=price,
-                    customer_name=customer.get("name",""),
-                    customer_email=customer.get("email",""),
-                ))
-        except Exception as e:
-            return jsonify({"ok": False, "error": f"Errore salvataggio DB: {e}"}), 500
+    # blocco capacità + salvataggio su DB (se configurato) in un solo passo
+    try:
+        reserved = reserve_nights(checkin, checkout, room_type, booking=dict(
+            booking_id=booking_id,
+            room_type=room_type,
+            guests=guests,
+            total_price=price,
+            customer_name=customer.get("name",""),
+            customer_email=customer.get("email",""),
+            coupon=applied_coupon(data.get("coupon")),
+        ))
+    except InventoryRangeError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"Errore salvataggio DB: {e}"}), 500
+    if not reserved:
+        return jsonify({"ok": False, "error": "Capacità esaurita per le date richieste"}), 400
+    remember_booking(booking_id, room_type, checkin, checkout, guests, price, customer,
+                     applied_coupon(data.get("coupon")))
+    vehicle_id = _assign_car_safe(booking_id, room_type, checkin, checkout)
 
     # risposta standard
     response = {
@@ -317,6 +3157,7 @@ def book():
         "checkout": checkout.strftime("%Y-%m-%d"),
         "guests": guests,
         "total_price": price,
+        "vehicle": vehicle_json(vehicle_id),
         "status": "reserved"
     }
 
@@ -328,6 +3169,192 @@ def book():
 
     return jsonify(response)
 
+def _book_from_hold(data):
+    """/book con hold_id: date, ospiti e prezzo sono quelli dell'hold."""
+    customer = data.get("customer")
+    if not isinstance(customer, dict):
+        return jsonify({"ok": False, "error": "Parametri non validi: 'customer'"}), 400
+
+    booking_id = new_booking_id()
+    try:
+        held = book_hold(str(data["hold_id"]), booking_id, customer)
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"Errore salvataggio DB: {e}"}), 500
+    if not held:
+        return jsonify({"ok": False, "error": "Hold scaduto o inesistente"}), 410
+    remember_booking(booking_id, held["room_type"], held["checkin"], held["checkout"],
+                     held["guests"], held["total_price"], customer, held.get("coupon"))
+    vehicle_id = _assign_car_safe(booking_id, held["room_type"], held["checkin"], held["checkout"])
+
+    response = {
+        "ok": True,
+        "booking_id": booking_id,
+        "product": PRODUCT["id"],
+        "room_type": held["room_type"],
+        "customer": customer,
+        "checkin": held["checkin"].strftime("%Y-%m-%d"),
+        "checkout": held["checkout"].strftime("%Y-%m-%d"),
+        "guests": held["guests"],
+        "total_price": held["total_price"],
+        "vehicle": vehicle_json(vehicle_id),
+        "status": "reserved"
+    }
+    try:
+        send_booking_email(response)
+    except Exception as e:
+        app.logger.warning(f"Email error: {e}")
+
+    return jsonify(response)
+
+def _assign_car_safe(booking_id, room_type, checkin, checkout):
+    """assign_car() best-effort: la prenotazione è già salvata, un errore qui va solo in log."""
+    try:
+        return assign_car(booking_id, room_type, checkin, checkout)
+    except Exception as e:
+        app.logger.warning(f"Assegnazione auto fallita per {booking_id}: {e}")
+        return None
+
+def _booking_json(booking_id, booking):
+    out = {
+        "ok": True,
+        "booking_id": booking_id,
+        "product": PRODUCT["id"],
+        "room_type": booking["room_type"],
+        "checkin": booking["checkin"].strftime("%Y-%m-%d"),
+        "checkout": booking["checkout"].strftime("%Y-%m-%d"),
+        "guests": booking["guests"],
+        "total_price": float(booking["total_price"]),
+    }
+    if "previous" in booking:
+        prev = booking["previous"]
+        out["previous"] = {"checkin": prev["checkin"].strftime("%Y-%m-%d"),
+                           "checkout": prev["checkout"].strftime("%Y-%m-%d"),
+                           "total_price": prev["total_price"]}
+    return out
+
+def _booking_changes_disabled():
+    return jsonify({"ok": False, "error": "Cancellazione e modifica non disponibili con l'inventario in shared memory"}), 501
+
+@app.route("/cancel", methods=["POST"])
+def cancel():
+    if not BOOKING_CHANGES_ENABLED:
+        return _booking_changes_disabled()
+    data = request.json or {}
+    try:
+        booking_id = str(data["booking_id"])
+        email      = str(data["email"])
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"Parametri non validi: {e}"}), 400
+    try:
+        ok, msg, booking = cancel_booking(booking_id, email)
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"Errore salvataggio DB: {e}"}), 500
+    if not ok:
+        return jsonify({"ok": False, "error": msg}), 404
+    try:
+        release_car(booking_id)
+    except Exception as e:
+        app.logger.warning(f"Riassegnazione auto fallita dopo {booking_id}: {e}")
+    notify_released([(booking["checkin"].toordinal(), booking["checkout"].toordinal())])
+    return jsonify({**_booking_json(booking_id, booking), "status": "cancelled"})
+
+@app.route("/modify", methods=["POST"])
+def modify():
+    if not BOOKING_CHANGES_ENABLED:
+        return _booking_changes_disabled()
+    data = request.json or {}
+    try:
+        booking_id = str(data["booking_id"])
+        email      = str(data["email"])
+        checkin    = parse_date(data["checkin"])
+        checkout   = parse_date(data["checkout"])
+        guests     = int(data["guests"]) if data.get("guests") is not None else None
+        room_type  = optional_str(data, "room_type")
+        coupon     = optional_str(data, "coupon")
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"Parametri non validi: {e}"}), 400
+    try:
+        ok, msg, booking = modify_booking(booking_id, email, checkin, checkout, guests=guests,
+                                          room_type=room_type, coupon=coupon)
+    except InventoryRangeError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"Errore salvataggio DB: {e}"}), 500
+    if not ok:
+        return jsonify({"ok": False, "error": msg}), 404 if booking is None else 400
+    vehicle_id = _assign_car_safe(booking_id, booking["room_type"], booking["checkin"], booking["checkout"])
+    prev = booking["previous"]
+    old = (prev["checkin"].toordinal(), prev["checkout"].toordinal())
+    # notti lasciate: tutto il vecchio soggiorno se cambia la tipologia
+    notify_released(nights_diff(*old, checkin.toordinal(), checkout.toordinal())
+                    if prev["room_type"] == booking["room_type"] else [old])
+    return jsonify({**_booking_json(booking_id, booking), "vehicle": vehicle_json(vehicle_id),
+                    "status": "modified"})
+
+def _waitlist_json(entry):
+    out = {
+        "ok": True,
+        "waitlist_id": entry["waitlist_id"],
+        "product": PRODUCT["id"],
+        "room_type": entry["room_type"],
+        "checkin": entry["checkin"].strftime("%Y-%m-%d"),
+        "checkout": entry["checkout"].strftime("%Y-%m-%d"),
+        "guests": entry["guests"],
+        "status": entry["status"],
+    }
+    if entry.get("hold_id"):
+        out["hold_id"] = entry["hold_id"]
+        if entry.get("expires_at"):
+            out["total_price"] = float(entry["total_price"])
+            out["expires_at"] = entry["expires_at"].strftime("%Y-%m-%dT%H:%M:%SZ")
+    return out
+
+@app.route("/waitlist", methods=["POST"])
+def waitlist():
+    """Iscrizione alla lista d'attesa per un soggiorno esaurito."""
+    if not HOLDS_ENABLED:
+        # le offerte sono hold
+        return jsonify({"ok": False, "error": "Lista d'attesa non disponibile con l'inventario in shared memory"}), 501
+    data = request.json or {}
+    try:
+        checkin   = parse_date(data["checkin"])
+        checkout  = parse_date(data["checkout"])
+        guests    = int(data["guests"])
+        customer  = data["customer"]  # {"name":..., "email":...}
+        room_type = (data.get("room_type") or "standard").lower()
+        if not customer.get("email"):
+            raise ValueError("'customer.email' mancante")
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"Parametri non validi: {e}"}), 400
+
+    ok, msg, price = quote_price(checkin, checkout, guests, room_type=room_type)
+    if ok:
+        return jsonify({"ok": False, "error": "Soggiorno disponibile: prenota direttamente",
+                        "total_price": price}), 409
+    # solo i soggiorni validi ma esauriti: tipologia e ospiti già verificati se l'errore è di capacità
+    valid = room_type in ROOM_TYPES and 1 <= guests <= ROOM_TYPES[room_type]["max_guests"]
+    unavailable = stay_unavailable(checkin, checkout, room_type) if valid else None
+    if not unavailable or unavailable[0] != QUOTE_ERR_CAPACITY:
+        return jsonify({"ok": False, "error": msg}), 400
+    try:
+        entry = join_waitlist(checkin, checkout, guests, room_type, customer)
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"Errore salvataggio DB: {e}"}), 500
+    if entry is None:
+        return jsonify({"ok": False, "error": "Lista d'attesa piena, riprova più tardi"}), 503
+    return jsonify(_waitlist_json(entry))
+
+@app.route("/waitlist/<waitlist_id>", methods=["GET"])
+def waitlist_status(waitlist_id):
+    """Stato della richiesta; se 'offered', hold_id e scadenza dell'offerta da confermare con /book."""
+    try:
+        entry = waitlist_entry(waitlist_id, request.args.get("email", ""))
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"Errore DB: {e}"}), 500
+    if not entry:
+        return jsonify({"ok": False, "error": "Richiesta non trovata"}), 404
+    return jsonify(_waitlist_json(entry))
+
 # ---------------------------
 #  Endpoint admin (opzionali)
 # ---------------------------
@@ -339,17 +3366,57 @@ def admin_bookings():
         return jsonify({"ok": False, "error": "Unauthorized"}), 403
     if not engine:
         return jsonify({"ok": True, "db": False, "note": "DB non configurato",
-                        "bookings_sample": list(BOOKINGS.items())[:10]})
+                        "bookings_sample": {p: list(BOOKINGS[p].items())[:10] for p in POOL_NAMES}})
     with engine.begin() as conn:
         rows = conn.execute(text("""
             SELECT booking_id, product_id, room_type, checkin, checkout, guests,
-                   total_price, customer_name, customer_email, created_at
+                   total_price, customer_name, customer_email, created_at, status, vehicle_id
             FROM bookings
             ORDER BY created_at DESC
             LIMIT 200
         """)).mappings().all()
     return jsonify({"ok": True, "count": len(rows), "items": [dict(r) for r in rows]})
 
+@app.route("/admin/metrics", methods=["GET"])
+def admin_metrics():
+    if not _is_admin(request):
+        return jsonify({"ok": False, "error": "Unauthorized"}), 403
+    return jsonify({"ok": True, "quote_cache": quote_cache_stats(),
+                    "single_flight": single_flight_stats(), "warm_start": WARM_START_STATS,
+                    "holds": hold_stats(), "fleet": fleet_report(), "waitlist": waitlist_stats()})
+
+@app.route("/admin/pricing-report", methods=["GET"])
+def admin_pricing_report():
+    if not _is_admin(request):
+        return jsonify({"ok": False, "error": "Unauthorized"}), 403
+    return jsonify({"ok": True, **pricing_mode_report()})
+
+@app.route("/admin/parse-date-report", methods=["GET"])
+def admin_parse_date_report():
+    if not _is_admin(request):
+        return jsonify({"ok": False, "error": "Unauthorized"}), 403
+    return jsonify({"ok": True, **parse_date_report(n=min(int(request.args.get("dates", 20000)), 200000))})
+
+@app.route("/admin/room-plan", methods=["GET"])
+def admin_room_plan():
+    if not _is_admin(request):
+        return jsonify({"ok": False, "error": "Unauthorized"}), 403
+    try:
+        start = parse_date(request.args.get("from"))
+        end = parse_date(request.args.get("to")) + timedelta(days=1)
+        room_type = (request.args.get("room_type") or "standard").lower()
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    if room_type not in ROOM_TYPES:
+        return jsonify({"ok": False, "error": f"Tipologia camera non valida: {room_type}"}), 400
+    return jsonify({"ok": True, **room_plan(room_type, start, end)})
+
+@app.route("/admin/room-plan-report", methods=["GET"])
+def admin_room_plan_report():
+    if not _is_admin(request):
+        return jsonify({"ok": False, "error": "Unauthorized"}), 403
+    return jsonify({"ok": True, **room_plan_report(bookings=min(int(request.args.get("bookings", 5000)), 50000))})
+
 @app.route("/admin/export.csv", methods=["GET"])
 def admin_export_csv():
     if not _is_admin(request):
@@ -360,14 +3427,14 @@ def admin_export_csv():
     with engine.begin() as conn:
         rows = conn.execute(text("""
             SELECT booking_id, product_id, room_type, checkin, checkout, guests,
-                   total_price, customer_name, customer_email, created_at
+                   total_price, customer_name, customer_email, created_at, status, vehicle_id
             FROM bookings
             ORDER BY created_at DESC
         """)).all()
     buf = io.StringIO()
     w = csv.writer(buf)
     w.writerow(["booking_id","product_id","room_type","checkin","checkout","guests",
-                "total_price","customer_name","customer_email","created_at"])
+                "total_price","customer_name","customer_email","created_at","status","vehicle_id"])
     w.writerows(rows)
     return buf.getvalue(), 200, {"Content-Type": "text/csv; charset=utf-8"}
 
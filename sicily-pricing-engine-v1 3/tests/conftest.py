@@ -0,0 +1,6 @@
+import os
+import sys
+
+# app.py sta nella cartella del progetto, non in un package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.pop("DATABASE_URL", None)
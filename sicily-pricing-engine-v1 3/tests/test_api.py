@@ -0,0 +1,179 @@
+import os
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def test_search_rejects_max_nights_longer_than_window(client):
+    r = client.post("/search", json={"from": "2026-11-01", "to": "2026-12-01", "guests": 2,
+                                     "min_nights": 2, "max_nights": 2000000})
+    assert r.status_code == 400
+
+
+def test_cheapest_stays_caps_nights_to_window():
+    from datetime import date
+    stays = app.cheapest_stays(date(2026, 11, 1), date(2026, 11, 6), 2, 10 ** 9, 2, k=100,
+                               today=date(2026, 10, 1))
+    assert stays and all(s["nights"] <= 5 for s in stays)
+
+
+def _book(client, **extra):
+    body = {"checkin": "2027-02-10", "checkout": "2027-02-13", "guests": 2,
+            "customer": {"name": "A", "email": "a@x.it"}, **extra}
+    r = client.post("/book", json=body).json
+    assert r["ok"], r
+    return r
+
+
+def test_modify_keeps_booking_coupon(client):
+    booked = _book(client, coupon="WELCOME10")
+    body = {"booking_id": booked["booking_id"], "email": "a@x.it",
+            "checkin": "2027-02-10", "checkout": "2027-02-13"}
+    same = client.post("/modify", json=body).json
+    assert same["total_price"] == booked["total_price"]
+    moved = client.post("/modify", json={**body, "checkin": "2027-02-11", "checkout": "2027-02-14"}).json
+    ok, _, expected = app.quote_price(app.date(2027, 2, 11), app.date(2027, 2, 14), 2, coupon="WELCOME10",
+                                      today=app.date.today())
+    assert moved["total_price"] == expected
+    dropped = client.post("/modify", json={**body, "coupon": ""}).json
+    assert dropped["total_price"] > expected
+
+
+@pytest.mark.parametrize("day, change", [(1, {"guests": 0}), (6, {"room_type": ["deluxe"]}),
+                                         (11, {"room_type": 3}), (16, {"coupon": ["x"]})])
+def test_modify_rejects_invalid_changes(client, day, change):
+    checkin = f"2027-04-{day:02d}"
+    booked = _book(client, checkin=checkin, checkout=f"2027-04-{day + 3:02d}")
+    body = {"booking_id": booked["booking_id"], "email": "a@x.it",
+            "checkin": checkin, "checkout": f"2027-04-{day + 4:02d}", **change}
+    r = client.post("/modify", json=body)
+    assert r.status_code == 400 and not r.json["ok"]
+    assert app.BOOKING_RECORDS[booked["booking_id"]]["guests"] == 2
+
+
+def test_parse_date_report_matches_strptime():
+    report = app.parse_date_report(n=2000)
+    assert report["equal"]
+    assert set(report["ms"]) == {"strptime", "fast", "fast_cached"}
+
+
+@pytest.mark.parametrize("minutes", [-5, 0, "nan", "inf", "abc"])
+def test_hold_rejects_invalid_minutes(client, minutes):
+    r = client.post("/hold", json={"checkin": "2027-03-10", "checkout": "2027-03-13", "guests": 2,
+                                   "minutes": minutes})
+    assert r.status_code == 400
+
+
+def test_calendar_rejects_month_past_date_max(client):
+    assert client.get("/calendar?month=9999-12").status_code == 400
+    r = client.get("/calendar?month=2027-12&nights=3")
+    assert r.status_code == 200 and len(r.json["days"]) == 31
+
+
+@pytest.mark.parametrize("outcome, checkin", [("booked", "2027-09-01"), ("expired", "2027-09-11")])
+def test_offered_waitlist_entry_leaves_memory(client, outcome, checkin):
+    checkout = (app.date.fromisoformat(checkin) + app.timedelta(days=3)).isoformat()
+    stay = {"checkin": checkin, "checkout": checkout, "guests": 2, "room_type": "family"}
+    booked = client.post("/book", json={**stay, "customer": {"name": "A", "email": "a@x.it"}}).json
+    joined = client.post("/waitlist", json={**stay, "customer": {"name": "W", "email": "w@x.it"}}).json
+    assert joined["status"] == "waiting"
+    client.post("/cancel", json={"booking_id": booked["booking_id"], "email": "a@x.it"})
+    entry = client.get(f"/waitlist/{joined['waitlist_id']}?email=w@x.it").json
+    assert entry["status"] == "offered"
+    if outcome == "booked":
+        assert client.post("/book", json={"hold_id": entry["hold_id"], "customer": {"email": "w@x.it"}}).json["ok"]
+    else:
+        app.expire_holds([entry["hold_id"]], now=app.datetime.utcnow() + app.timedelta(days=1))
+    assert joined["waitlist_id"] not in app.WAITLIST_IDS
+    assert entry["hold_id"] not in app.WAITLIST_HOLDS
+    assert client.get(f"/waitlist/{joined['waitlist_id']}?email=w@x.it").status_code == 404
+
+
+def test_stay_price_refreshes_stale_tensor_with_explicit_today(monkeypatch):
+    monkeypatch.setitem(app.QUOTE_TENSOR, "start", app.QUOTE_TENSOR["start"] - 3)
+    checkin = app.date.today() + app.timedelta(days=20)
+    checkout = checkin + app.timedelta(days=3)
+    price = app.stay_price("deluxe", checkin, checkout, 2, today=app.date.today())
+    assert app.QUOTE_TENSOR["start"] == app.datetime.utcnow().date().toordinal()
+    expected = app.apply_price_rules(app.stay_base_total_sequential("deluxe", checkin, checkout), 2, checkin,
+                                     app.date.today(), None)
+    assert price == round(expected, 2)
+
+
+@pytest.mark.parametrize("checkin, checkout", [("9999-12-01", "9999-12-04"), ("2020-01-10", "2020-01-13")])
+def test_book_rejects_stays_outside_bookable_window(client, checkin, checkout):
+    size = app.BOOKINGS["standard"].domain()
+    r = client.post("/book", json={"checkin": checkin, "checkout": checkout, "guests": 2,
+                                   "customer": {"name": "A", "email": "a@x.it"}})
+    assert r.status_code == 400 and "periodo prenotabile" in r.json["error"]
+    assert client.post("/quote", json={"checkin": checkin, "checkout": checkout, "guests": 2}).status_code == 400
+    assert app.BOOKINGS["standard"].domain() == size
+
+
+def test_quote_cache_expires_when_inventory_is_shared(monkeypatch):
+    monkeypatch.setattr(app, "BOOKINGS_SHARED", True)
+    monkeypatch.setattr(app, "INVENTORY_CACHE_TTL", 0)
+    checkin, checkout = app.date(2027, 4, 5), app.date(2027, 4, 8)
+    assert app.cached_quote_price(checkin, checkout, 2, room_type="family")[0]
+    # un altro worker riempie la notte nel segmento condiviso: niente invalidazione locale
+    app.BOOKINGS["family"].range_add(checkin.toordinal(), checkin.toordinal() + 1, 1)
+    try:
+        assert not app.cached_quote_price(checkin, checkout, 2, room_type="family")[0]
+    finally:
+        app.BOOKINGS["family"].range_add(checkin.toordinal(), checkin.toordinal() + 1, -1)
+
+
+def test_book_outside_shared_segment_is_a_client_error(client, monkeypatch, tmp_path):
+    # segmento di 400 giorni da un anno fa: finisce prima di BOOKING_HORIZON_DAYS
+    lock = app._ProcessLock(str(tmp_path / "inv.lock"))
+    name = f"spe-test-{os.getpid()}"
+    inv = app.PoolInventory(app.POOL_NAMES, lambda p: app.SharedInventory(f"{name}-{p}", 400, lock=lock), lock)
+    monkeypatch.setattr(app, "BOOKINGS", inv)
+    try:
+        checkin = app.date.today() + app.timedelta(days=100)
+        r = client.post("/book", json={"checkin": checkin.isoformat(),
+                                       "checkout": (checkin + app.timedelta(days=3)).isoformat(),
+                                       "guests": 2, "customer": {"name": "A", "email": "a@x.it"}})
+        assert r.status_code == 400 and "orizzonte inventario" in r.json["error"]
+    finally:
+        for p in app.POOL_NAMES:
+            inv[p]._shm.close()
+            inv[p]._shm.unlink()
+
+
+def test_hold_and_waitlist_refused_with_shared_memory_inventory(client, monkeypatch):
+    monkeypatch.setattr(app, "HOLDS_ENABLED", False)
+    body = {"checkin": "2027-03-20", "checkout": "2027-03-23", "guests": 2,
+            "customer": {"name": "W", "email": "w@x.it"}}
+    assert client.post("/hold", json=body).status_code == 501
+    assert client.post("/waitlist", json=body).status_code == 501
+    with pytest.raises(RuntimeError):
+        app.create_hold(app.date(2027, 3, 20), app.date(2027, 3, 23), 2, "standard", 100.0)
+
+
+def test_cancel_and_modify_refused_with_shared_memory_inventory(client, monkeypatch):
+    booked = _book(client, checkin="2027-03-24", checkout="2027-03-27")
+    monkeypatch.setattr(app, "BOOKING_CHANGES_ENABLED", False)
+    body = {"booking_id": booked["booking_id"], "email": "a@x.it",
+            "checkin": "2027-03-24", "checkout": "2027-03-28"}
+    assert client.post("/modify", json=body).status_code == 501
+    assert client.post("/cancel", json=body).status_code == 501
+    assert app.BOOKING_RECORDS[booked["booking_id"]]["status"] == "reserved"
+
+
+def test_quote_batch_reports_bad_items_one_by_one(client):
+    stay = {"checkin": "2027-05-10", "checkout": "2027-05-13", "guests": 2}
+    items = [stay, {**stay, "coupon": ["x"]}, {**stay, "room_type": 7}, {**stay, "coupon": {"a": 1}},
+             {**stay, "coupon": "WELCOME10"}, "2027-05-10"]
+    r = client.post("/quote/batch", json={"items": items})
+    assert r.status_code == 200
+    results = r.json["results"]
+    assert [x["ok"] for x in results] == [True, False, False, False, True, False]
+    assert all("Parametri non validi" in x["error"] for x in results if not x["ok"])
+    assert results[4]["total_price"] < results[0]["total_price"]
@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+import app
+
+
+def test_inventory_tree_fuzz_against_dict():
+    """20k operazioni casuali, anche fuori dal dominio iniziale, confrontate con un dict."""
+    rnd = random.Random(13)
+    tree = app.InventoryTree(days=64)
+    model = {}
+    base, _ = tree.domain()
+    for _ in range(20000):
+        op = rnd.random()
+        # un quinto delle operazioni cade prima o dopo il dominio corrente (entro il tetto)
+        lo, hi = tree.domain()
+        if rnd.random() < 0.2:
+            a = rnd.choice([max(lo - rnd.randrange(1, 40), base - 2000),
+                            min(hi + rnd.randrange(0, 40), base + 2000)])
+        else:
+            a = rnd.randrange(max(lo, base - 2000), min(hi, base + 2000))
+        b = a + rnd.randrange(0, 30)
+        if op < 0.4:
+            x = rnd.choice([1, 1, 2, -1])
+            tree.range_add(a, b, x)
+            for o in range(a, b):
+                model[o] = model.get(o, 0) + x
+        elif op < 0.55:
+            values = [rnd.randrange(0, 5) for _ in range(b - a)]
+            tree.assign(a, values)
+            model.update(zip(range(a, b), values))
+        elif op < 0.8:
+            expected = max((model.get(o, 0) for o in range(a, b)), default=0) if b > a else 0
+            assert tree.range_max(a, b) == expected
+        else:
+            assert tree.counts(a, b) == [model.get(o, 0) for o in range(a, b)]
+    lo, hi = tree.domain()
+    assert hi - lo <= app.INVENTORY_TREE_MAX_DAYS
+    assert tree.counts(lo - 10, hi + 10) == [model.get(o, 0) for o in range(lo - 10, hi + 10)]
+    assert lo < base
+
+
+def test_inventory_tree_grows_once_for_earlier_days():
+    tree = app.InventoryTree()
+    base, end = tree.domain()
+    for k in range(1, 16):
+        tree.range_add(base - k, base - k + 1, 1)
+    lo, hi = tree.domain()
+    assert hi - lo == 2 * (end - base)
+    assert tree.counts(base - 15, base) == [1] * 15
+
+
+def test_inventory_tree_rejects_writes_past_ceiling():
+    tree = app.InventoryTree()
+    tree.range_add(tree.domain()[0] + 5, tree.domain()[0] + 8, 1)
+    before = tree.domain(), tree.counts(*tree.domain())
+    far = app.date(9999, 12, 1).toordinal()
+    with pytest.raises(ValueError):
+        tree.range_add(far, far + 3, 1)
+    with pytest.raises(ValueError):
+        tree.assign(far, [1, 1])
+    assert (tree.domain(), tree.counts(*tree.domain())) == before
@@ -0,0 +1,76 @@
+import os
+import time
+
+import app
+
+
+def test_process_lock_excludes_forked_workers(tmp_path):
+    """Come con gunicorn --preload: lock creato nel padre, usato da padre e figlio dopo il fork."""
+    lock = app._ProcessLock(str(tmp_path / "inv.lock"))
+    with lock:
+        pass  # il padre usa il lock prima del fork, come il master all'import
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(r)
+            with lock:
+                os.write(w, b"x")
+                time.sleep(0.5)
+        finally:
+            os._exit(0)
+    os.close(w)
+    assert os.read(r, 1) == b"x"   # il figlio ha il lock
+    t0 = time.perf_counter()
+    with lock:
+        waited = time.perf_counter() - t0
+    os.waitpid(pid, 0)
+    assert waited >= 0.3
+
+
+def test_process_lock_reentrant(tmp_path):
+    lock = app._ProcessLock(str(tmp_path / "inv.lock"))
+    with lock:
+        with lock:
+            pass
+
+
+def test_process_lock_threads_in_forked_worker(tmp_path):
+    """Come con gunicorn --preload e gthread: più thread del worker al primo uso del lock dopo il fork."""
+    import threading
+    lock = app._ProcessLock(str(tmp_path / "inv.lock"))
+    lock.__enter__()   # il padre tiene il lock durante il fork e per un po' dopo
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            inside, errors = [0], []
+            start = threading.Barrier(8)
+            t0 = time.perf_counter()
+
+            def work():
+                start.wait()   # tutti al primo uso del lock insieme
+                try:
+                    for _ in range(50):
+                        with lock:
+                            inside[0] += 1
+                            if inside[0] != 1:
+                                errors.append("due thread nella sezione critica")
+                            time.sleep(0.0005)
+                            inside[0] -= 1
+                except Exception as e:
+                    errors.append(repr(e))
+
+            threads = [threading.Thread(target=work) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            waited = time.perf_counter() - t0
+            code = 0 if not errors and waited >= 0.3 else 1
+        finally:
+            os._exit(code)
+    time.sleep(0.4)
+    lock.__exit__(None, None, None)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
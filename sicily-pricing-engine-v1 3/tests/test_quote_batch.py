@@ -0,0 +1,83 @@
+import random
+import threading
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+
+import app
+
+
+@pytest.fixture
+def calendar():
+    """Stagione e blackout dentro il periodo prenotabile, e giorni esauriti su un inventario nuovo."""
+    today = datetime.utcnow().date()
+    with pytest.MonkeyPatch.context() as mp:
+        # 1.15 e 1.35 danno tariffe con mezzi centesimi: molti totali vicini al mezzo centesimo
+        mp.setattr(app, "SEASON_FACTORS", [
+            {"from": (today + timedelta(20)).isoformat(), "to": (today + timedelta(90)).isoformat(), "factor": 1.15},
+            {"from": (today + timedelta(300)).isoformat(), "to": (today + timedelta(520)).isoformat(), "factor": 1.35},
+        ])
+        blackout = [today + timedelta(d) for d in (12, 45, 46, 410, 650)]
+        mp.setitem(app.PRODUCT, "blackout_dates", [d.isoformat() for d in blackout])
+        lock = threading.RLock()
+        mp.setattr(app, "BOOKINGS", app.PoolInventory(app.POOL_NAMES, lambda p: app.InventoryTree(lock=lock), lock))
+        # esauriti: lo stesso giorno di un blackout (vince il blackout), il giorno prima e dopo, altri sparsi
+        for pool, day in (("standard", 45), ("family", 44), ("deluxe", 47), ("auto", 410),
+                          ("standard", 200), ("family", 201), ("auto", 600), ("deluxe", 649)):
+            o = (today + timedelta(day)).toordinal()
+            app.BOOKINGS[pool].range_add(o, o + 1, app.POOLS[pool])
+        mp.setattr(app, "PRICING_MODE", "float")
+        app.reload_pricing_config()
+        yield mp, today
+    app.reload_pricing_config()
+
+
+def _items(today, n, seed):
+    rnd = random.Random(seed)
+    first, last = app.bookable_window()
+    ci = [rnd.randrange(first - 5, last + 5) for _ in range(n)]
+    co = [c + rnd.randrange(0, 21) for c in ci]
+    # metà dei check-in vicino a blackout e giorni esauriti
+    for i in range(0, n, 2):
+        ci[i] = today.toordinal() + rnd.choice([12, 45, 200, 410, 600, 650]) - rnd.randrange(0, 6)
+        co[i] = ci[i] + rnd.randrange(1, 9)
+    guests = [rnd.randrange(0, 6) for _ in range(n)]
+    room_types = [rnd.choice(["standard", "deluxe", "family", "Family", "suite", None]) for _ in range(n)]
+    coupons = [rnd.choice([None, "WELCOME10", "STUDENT5", "X"]) for _ in range(n)]
+    return ci, co, guests, room_types, coupons
+
+
+def _scalar_code(checkin, checkout, guests, room_type):
+    """Codice QUOTE_* dagli stessi controlli di quote_price()."""
+    rt = (room_type or "standard").lower()
+    if rt not in app.ROOM_TYPES:
+        return app.QUOTE_ERR_ROOM_TYPE
+    if not 1 <= guests <= app.ROOM_TYPES[rt]["max_guests"]:
+        return app.QUOTE_ERR_GUESTS
+    unavailable = app.stay_unavailable(checkin, checkout, rt)
+    return unavailable[0] if unavailable else app.QUOTE_OK
+
+
+@pytest.mark.parametrize("mode", ["float", "cents"])
+def test_quote_price_batch_matches_scalar(calendar, mode):
+    mp, today = calendar
+    mp.setattr(app, "PRICING_MODE", mode)
+    app.reload_pricing_config()
+    ci, co, guests, room_types, coupons = _items(today, 6000, seed=8)
+    prices, codes = app.quote_price_batch(ci, co, guests, room_types, coupons, today=today)
+    ties = 0
+    for i in range(len(ci)):
+        d_in, d_out = date.fromordinal(ci[i]), date.fromordinal(co[i])
+        ok, msg, price = app.quote_price(d_in, d_out, guests[i], coupon=coupons[i], today=today,
+                                         room_type=room_types[i])
+        assert codes[i] == _scalar_code(d_in, d_out, guests[i], room_types[i]), (i, msg)
+        if ok:
+            assert prices[i] == price, (i, d_in, d_out, guests[i], room_types[i], coupons[i])
+            rt = (room_types[i] or "standard").lower()
+            ties += app.near_rounding_tie(app.apply_price_rules(
+                app.stay_base_total_sequential(rt, d_in, d_out), guests[i], d_in, today, coupons[i]))
+        else:
+            assert np.isnan(prices[i])
+    assert set(np.unique(codes)) == set(range(7)), np.bincount(codes)
+    assert ties > 0, "nessun totale vicino al mezzo centesimo nel campione"
@@ -0,0 +1,90 @@
+"""
+Stress di /book: migliaia di prenotazioni concorrenti su un PoolInventory nuovo.
+La capacità di ogni pool non va mai superata e l'inventario deve coincidere con
+le prenotazioni accettate. Eseguibile anche da solo per misurare il throughput:
+
+    python tests/test_stress_book.py [richieste] [thread]
+"""
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+
+if __name__ == "__main__":
+    import conftest  # noqa: F401  (path del progetto, niente DATABASE_URL)
+
+import app
+
+BASE = date(2028, 3, 6)
+DAYS = 30
+
+
+def _requests(n, seed=7):
+    rnd = random.Random(seed)
+    reqs = []
+    for i in range(n):
+        ci = BASE + timedelta(rnd.randrange(0, DAYS - 6))
+        co = ci + timedelta(rnd.randrange(2, 6))
+        reqs.append({"checkin": ci.isoformat(), "checkout": co.isoformat(), "guests": 2,
+                     "room_type": rnd.choice(list(app.ROOM_TYPES)),
+                     "customer": {"name": f"c{i}", "email": f"c{i}@x.it"}})
+    return reqs
+
+
+def run_stress(n=3000, threads=32):
+    """Spara n /book da `threads` thread; ritorna (accettate, occupazione replay, secondi)."""
+    reqs = _requests(n)
+    local = threading.local()
+
+    def call(body):
+        if not hasattr(local, "client"):
+            local.client = app.app.test_client()
+        return local.client.post("/book", json=body).json
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(threads) as ex:
+        res = list(ex.map(call, reqs))
+    dt = time.perf_counter() - t0
+    assert all(r["ok"] or "Capacità esaurita" in r["error"] for r in res), \
+        [r for r in res if not r["ok"] and "Capacità esaurita" not in r["error"]][:3]
+    accepted = [b for b, r in zip(reqs, res) if r["ok"]]
+    # ricostruisce l'occupazione pool x giorni dalle prenotazioni accettate
+    a = BASE.toordinal()
+    occ = np.zeros((len(app.POOL_NAMES), DAYS), dtype=np.int64)
+    for b in accepted:
+        ci = date.fromisoformat(b["checkin"]).toordinal() - a
+        co = date.fromisoformat(b["checkout"]).toordinal() - a
+        for p in app.ROOM_POOLS[b["room_type"]]:
+            occ[app.POOL_NAMES.index(p), ci:co] += 1
+    return accepted, occ, dt
+
+
+def _fresh_inventory():
+    lock = threading.RLock()
+    return app.PoolInventory(app.POOL_NAMES, lambda p: app.InventoryTree(lock=lock), lock)
+
+
+def test_concurrent_book_never_exceeds_pool_capacity(monkeypatch):
+    monkeypatch.setattr(app, "BOOKINGS", _fresh_inventory())
+    accepted, occ, _ = run_stress(2000, 32)
+    assert accepted
+    assert (occ <= app.POOL_CAPS[:, None]).all()
+    a = BASE.toordinal()
+    assert (app.BOOKINGS.matrix(a, a + DAYS) == occ).all(), "inventario != prenotazioni accettate"
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    app.BOOKINGS = _fresh_inventory()
+    accepted, occ, dt = run_stress(n, threads)
+    a = BASE.toordinal()
+    assert (occ <= app.POOL_CAPS[:, None]).all()
+    assert (app.BOOKINGS.matrix(a, a + DAYS) == occ).all(), "inventario != prenotazioni accettate"
+    print(f"{n} /book, {threads} thread: {len(accepted)} accettate, "
+          f"occupazione max {dict(zip(app.POOL_NAMES, occ.max(axis=1).tolist()))} "
+          f"/ capacità {app.POOLS}, {n / dt:.0f} req/s")